@@ -0,0 +1,125 @@
+import argparse
+import csv
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import partial
+
+import metrics
+import pipeline
+from llm import chatgpt_prompt, hedger, response_cache
+from gears import inject_fact, solve_gears
+from metrics import RunMetrics
+from router import router
+
+
+def read_problems(path):
+    # JSONL lines or CSV rows with a "problem" field and an optional "id".
+    with open(path, newline="", encoding="utf-8") as f:
+        if path.endswith(".csv"):
+            rows = list(csv.DictReader(f))
+        else:
+            rows = [json.loads(line) for line in f if line.strip()]
+    return [{"id": str(row.get("id") or i), "problem": row["problem"]} for i, row in enumerate(rows, 1)]
+
+
+def finished_ids(path):
+    # Anything already written without an error counts as done; failed items are retried.
+    done = set()
+    if not os.path.exists(path):
+        return done
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue  # a line cut short by a crash
+            if not record.get("error"):
+                done.add(record["id"])
+    return done
+
+
+def solve(item, strategy, counts, call, metrics_jsonl=None, metrics_prom=None, exact="inform"):
+    # strategy is a pipeline.STRATEGIES name, or "auto" to route each problem.
+    # exact says what to do with gear problems the exact solver can read: "answer" them without
+    # any calls, "inform" the Red Team and Reasoner of the result, or ignore them ("off").
+    started = time.time()
+    record = {"id": item["id"], "problem": item["problem"], "stages": {}}
+    run_metrics = RunMetrics(run_id=item["id"])
+    verified = solve_gears(item["problem"]) if exact != "off" else None
+    if verified and exact == "answer":
+        record.update(strategy="exact", final_answer=verified["fact"], seconds=round(time.time() - started, 3),
+                      usage=run_metrics.totals())
+        record["stages"]["exact"] = verified["fact"]
+        return record
+    try:
+        if strategy == "auto":
+            strategy = router.route(item["problem"])["strategy"]
+        record["strategy"] = strategy
+        stages = pipeline.build_stages(pipeline.STRATEGIES[strategy][1](*counts))
+        if verified:
+            stages = inject_fact(stages, verified)
+        for stage, output in pipeline.run_stages(item["problem"], stages, call=call, metrics=run_metrics):
+            record["stages"][stage.name] = output
+        record["final_answer"] = record["stages"].get(stages[-1].name)
+    except Exception as e:
+        record["error"] = f"{type(e).__name__}: {e}"
+    record["seconds"] = round(time.time() - started, 3)
+    record["usage"] = run_metrics.totals()
+    metrics.export(run_metrics, metrics_jsonl, metrics_prom)
+    return record
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the problem-solving pipeline over a file of problems.")
+    parser.add_argument("input", help="JSONL or CSV file with a 'problem' field (and optionally 'id')")
+    parser.add_argument("output", help="JSONL file to append results to; existing results are skipped")
+    parser.add_argument("--workers", type=int, default=4, help="problems processed at once")
+    parser.add_argument("--max-in-flight", type=int, default=pipeline.MAX_IN_FLIGHT, help="cap on concurrent API requests")
+    parser.add_argument("--strategy", choices=["auto"] + list(pipeline.STRATEGIES), default="auto",
+                        help="approach to use; auto lets the router pick per problem (ROUTER_METHOD=local|llm)")
+    parser.add_argument("--exact", choices=["answer", "inform", "off"], default="inform",
+                        help="gear problems the exact solver can read: answer them locally, pass the result to the "
+                             "Red Team and Reasoner, or ignore it")
+    parser.add_argument("--solutions", type=int, default=2)
+    parser.add_argument("--challenges", type=int, default=2)
+    parser.add_argument("--fresh", action="store_true", help="ignore cached responses")
+    parser.add_argument("--metrics-jsonl", help="append per-stage timing/token/cost rows to this file")
+    parser.add_argument("--metrics-prom", help="keep Prometheus-format totals in this file")
+    args = parser.parse_args(argv)
+
+    pipeline.set_max_in_flight(args.max_in_flight)
+    call = partial(chatgpt_prompt, fresh=args.fresh)
+
+    items = read_problems(args.input)
+    done = finished_ids(args.output)
+    todo = [item for item in items if item["id"] not in done]
+    print(f"{len(items)} problems, {len(items) - len(todo)} already done, {len(todo)} to run", file=sys.stderr)
+
+    failures = 0
+    # Finished stages of an interrupted problem are in the response cache, so re-running it
+    # only pays for the stages that hadn't completed.
+    with open(args.output, "a", encoding="utf-8") as out, ThreadPoolExecutor(max_workers=args.workers) as pool:
+        futures = [pool.submit(solve, item, args.strategy, (args.solutions, args.challenges), call,
+                               args.metrics_jsonl, args.metrics_prom, args.exact) for item in todo]
+        for count, future in enumerate(as_completed(futures), 1):
+            record = future.result()
+            out.write(json.dumps(record, ensure_ascii=False) + "\n")
+            out.flush()
+            if record.get("error"):
+                failures += 1
+                print(f"[{count}/{len(todo)}] {record['id']} failed: {record['error']}", file=sys.stderr)
+            else:
+                print(f"[{count}/{len(todo)}] {record['id']} done in {record['seconds']}s ({record['strategy']})", file=sys.stderr)
+
+    print(f"finished with {failures} failures; cache {response_cache.stats()}", file=sys.stderr)
+    if hedger.enabled:
+        for stage, totals in hedger.report().items():
+            print(f"hedging {stage}: {totals}", file=sys.stderr)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
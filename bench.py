@@ -0,0 +1,191 @@
+import argparse
+import json
+import resource
+import sys
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+import openai
+
+import llm
+import pipeline
+from cache import ResponseCache
+from mock_openai import MockSettings, start_mock
+from ratelimit import RequestScheduler
+
+PROBLEM = "7 axles are equally spaced around a circle. A gear is placed on each axle such that each gear is engaged with the gear to its left and the gear to its right. The gears are numbered 1 to 7 around the circle. If gear 3 were rotated clockwise, in which direction would gear 7 rotate?"
+
+
+def percentile(values, p):
+    if not values:
+        return float("nan")
+    values = sorted(values)
+    k = (len(values) - 1) * p / 100
+    lower = int(k)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (k - lower)
+
+
+def summarize(values):
+    return {"p50": percentile(values, 50), "p95": percentile(values, 95), "p99": percentile(values, 99), "n": len(values)}
+
+
+class Timings:
+    def __init__(self):
+        self.stages = {}
+
+    def add(self, stage, seconds):
+        self.stages.setdefault(stage, []).append(seconds)
+
+
+SYSTEM_ROLES = {
+    pipeline.SOLVER_SYSTEM: "solver",
+    pipeline.RED_TEAM_SYSTEM: "red_team",
+    pipeline.REASONER_SYSTEM: "reasoner",
+    pipeline.FINAL_SYSTEM: "final",
+}
+
+
+def timed_call(call, timings, streaming):
+    # Wraps a stage call to record its duration per role (and time to first token when streaming).
+    def prompt_id(messages):
+        return SYSTEM_ROLES.get(messages[0]["content"], "other")
+
+    if not streaming:
+        def run(messages, temperature, **kwargs):
+            started = time.perf_counter()
+            try:
+                return call(messages, temperature, **kwargs)
+            finally:
+                timings.add(prompt_id(messages), time.perf_counter() - started)
+        return run
+
+    def run_stream(messages, temperature, **kwargs):
+        started = time.perf_counter()
+        first = None
+        for delta in call(messages, temperature, **kwargs):
+            if first is None:
+                first = time.perf_counter() - started
+                timings.add("ttft", first)
+            yield delta
+        timings.add(prompt_id(messages), time.perf_counter() - started)
+    return run_stream
+
+
+def run_serial(problem, stages, call):
+    # The original behaviour: one blocking call after another.
+    outputs = {}
+    for stage in stages:
+        outputs[stage.name] = call(stage.prompt(problem, pipeline._inputs(stage, stages, outputs)), 0.7)
+    return outputs
+
+
+def run_graph(problem, stages, call):
+    return dict((stage.name, output) for stage, output in pipeline.run_stages(problem, stages, call=call))
+
+
+def run_stream(problem, stages, call):
+    return dict((stage.name, output) for stage, output in pipeline.run_stages(problem, stages, call=call, on_delta=lambda stage, text: None))
+
+
+# Every call is fresh so repeated runs of the same problem reach the mock instead of the cache.
+STRATEGIES = {
+    "serial": (run_serial, partial(llm.chatgpt_prompt, fresh=True), False),
+    "graph": (run_graph, partial(llm.chatgpt_prompt, fresh=True), False),
+    "stream": (run_stream, partial(llm.chatgpt_stream, fresh=True), True),
+}
+
+
+def bench(strategy, concurrency, runs, stages):
+    runner, call, streaming = STRATEGIES[strategy]
+    timings = Timings()
+    wrapped = timed_call(call, timings, streaming)
+    latencies = []
+    errors = 0
+
+    def one(_):
+        started = time.perf_counter()
+        runner(PROBLEM, stages, wrapped)
+        return time.perf_counter() - started
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        futures = [pool.submit(one, i) for i in range(runs)]
+        for future in futures:
+            try:
+                latencies.append(future.result())
+            except Exception:
+                errors += 1
+    elapsed = time.perf_counter() - started
+    return {
+        "strategy": strategy,
+        "concurrency": concurrency,
+        "runs": runs,
+        "errors": errors,
+        "runs_per_minute": 60 * len(latencies) / elapsed if elapsed else 0.0,
+        "end_to_end": summarize(latencies),
+        "stages": {role: summarize(timings.stages[role]) for role in SYSTEM_ROLES.values() if role in timings.stages},
+        "ttft": summarize(timings.stages.get("ttft", [])),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the pipeline against a local mock of the OpenAI API.")
+    parser.add_argument("--strategies", default="serial,graph,stream")
+    parser.add_argument("--concurrency", default="1,4,16", help="comma-separated numbers of concurrent runs")
+    parser.add_argument("--runs", type=int, default=16, help="runs per strategy and concurrency level")
+    parser.add_argument("--solutions", type=int, default=2)
+    parser.add_argument("--challenges", type=int, default=2)
+    parser.add_argument("--max-in-flight", type=int, default=pipeline.MAX_IN_FLIGHT)
+    parser.add_argument("--ttft", type=float, default=0.3)
+    parser.add_argument("--per-token", type=float, default=0.002)
+    parser.add_argument("--jitter", type=float, default=0.2)
+    parser.add_argument("--completion-tokens", type=int, default=100)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0)
+    parser.add_argument("--rpm", type=int, default=100000, help="scheduler requests-per-minute budget")
+    parser.add_argument("--tpm", type=int, default=100000000, help="scheduler tokens-per-minute budget")
+    parser.add_argument("--json", help="also write results to this file")
+    args = parser.parse_args(argv)
+
+    server, state = start_mock(MockSettings(args.ttft, args.per_token, args.jitter, args.completion_tokens,
+                                            args.error_rate, args.rate_limit_rate))
+    openai.api_base = server.url
+    openai.api_key = "sk-mock"
+    # Keep benchmark responses out of the on-disk cache
+    llm.response_cache = ResponseCache(None)
+    # Budgets default high enough that only the mock's own latency and 429s slow things down
+    llm.scheduler = RequestScheduler(args.rpm, args.tpm, retryable=llm.scheduler.retryable)
+    pipeline.set_max_in_flight(args.max_in_flight)
+    stages = pipeline.build_stages(pipeline.red_team_pipeline(args.solutions, args.challenges))
+
+    tracemalloc.start()
+    results = []
+    for strategy in args.strategies.split(","):
+        for concurrency in [int(c) for c in args.concurrency.split(",")]:
+            tracemalloc.reset_peak()
+            result = bench(strategy, concurrency, args.runs, stages)
+            result["peak_python_mb"] = tracemalloc.get_traced_memory()[1] / 2 ** 20
+            results.append(result)
+            e2e = result["end_to_end"]
+            print(f"{strategy:>7} x{concurrency:<3} p50 {e2e['p50']:.2f}s p95 {e2e['p95']:.2f}s p99 {e2e['p99']:.2f}s "
+                  f"{result['runs_per_minute']:.1f} runs/min  errors {result['errors']}  peak {result['peak_python_mb']:.1f}MB")
+            for role, stats in result["stages"].items():
+                print(f"          {role:<9} p50 {stats['p50']:.2f}s p95 {stats['p95']:.2f}s p99 {stats['p99']:.2f}s")
+            if result["ttft"]["n"]:
+                print(f"          ttft      p50 {result['ttft']['p50']:.2f}s p95 {result['ttft']['p95']:.2f}s")
+    # ru_maxrss is KiB on Linux
+    print(f"scheduler {llm.scheduler.stats}")
+    print(f"max RSS {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.1f}MB, "
+          f"mock saw {state.requests} requests ({state.errors} errors, {state.rate_limited} rate limited)")
+    server.shutdown()
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
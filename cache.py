@@ -0,0 +1,129 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+
+def cache_key(model, temperature, messages, sample=0):
+    # sample separates requests that are identical on purpose (e.g. two solvers with the same
+    # prompt) so they don't collapse onto one cached answer.
+    payload = json.dumps({"model": model, "temperature": temperature, "messages": messages, "sample": sample},
+                         sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    # Two tiers: an in-memory LRU in front of one JSON file per key on disk. Disk entries
+    # expire after ttl seconds and the oldest are evicted once the directory exceeds max_bytes.
+
+    def __init__(self, directory=None, max_entries=1024, max_bytes=256 * 1024 * 1024, ttl=30 * 24 * 3600):
+        self.directory = directory
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._disk_bytes = None
+
+    def stats(self):
+        return {"hits": self.hits, "disk_hits": self.disk_hits, "misses": self.misses, "memory_entries": len(self._memory)}
+
+    def get(self, key):
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                return self._memory[key]
+        value = self._read(key)
+        with self._lock:
+            if value is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.disk_hits += 1
+            self._remember(key, value)
+        return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._remember(key, value)
+        self._write(key, value)
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            self._disk_bytes = None
+        if self.directory and os.path.isdir(self.directory):
+            for name in os.listdir(self.directory):
+                if name.endswith(".json"):
+                    os.remove(os.path.join(self.directory, name))
+
+    def _remember(self, key, value):
+        self._memory[key] = value
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.json")
+
+    def _read(self, key):
+        if not self.directory:
+            return None
+        path = self._path(key)
+        try:
+            if time.time() - os.path.getmtime(path) > self.ttl:
+                os.remove(path)
+                return None
+            with open(path, encoding="utf-8") as f:
+                return json.load(f)["value"]
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def _write(self, key, value):
+        if not self.directory:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        path = self._path(key)
+        tmp = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"value": value}, f, ensure_ascii=False)
+        os.replace(tmp, path)
+        with self._lock:
+            if self._disk_bytes is None:
+                self._disk_bytes = sum(size for _, size, _ in self._disk_entries())
+            else:
+                self._disk_bytes += os.path.getsize(path)
+            if self._disk_bytes > self.max_bytes:
+                self._evict()
+
+    def _disk_entries(self):
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith(".json"):
+                try:
+                    stat = os.stat(os.path.join(self.directory, name))
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, name))
+        return entries
+
+    def _evict(self):
+        # Drop expired entries first, then oldest-first until we're back under 90% of the cap.
+        entries = sorted(self._disk_entries())
+        total = sum(size for _, size, _ in entries)
+        now = time.time()
+        for mtime, size, name in entries:
+            if total <= self.max_bytes * 0.9 and now - mtime <= self.ttl:
+                continue
+            try:
+                os.remove(os.path.join(self.directory, name))
+                total -= size
+            except OSError:
+                pass
+        self._disk_bytes = total
@@ -0,0 +1,60 @@
+import re
+
+from metrics import estimate_prompt_tokens, estimate_tokens
+
+# Sentences that state a result are what later stages need most
+CONCLUSION_MARKERS = re.compile(
+    r"\b(therefore|thus|hence|so(?=,)|as a result|in conclusion|conclusion|consequently|the answer|final answer|"
+    r"best solution|correct|incorrect|wrong|fail(s|ed)? to|contradiction|impossible|cannot|would (rotate|lock|be))\b",
+    re.IGNORECASE,
+)
+
+
+def _sentences(text):
+    return [s.strip() for s in re.split(r"(?<=[.!?])\s+|\n+", text) if s.strip()]
+
+
+def compact(text, max_tokens):
+    # Keep the sentences most likely to carry the claim (conclusion markers, the closing lines,
+    # the opening line) in their original order until max_tokens is used up.
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    sentences = _sentences(text)
+    scored = []
+    for i, sentence in enumerate(sentences):
+        score = 2.0 if CONCLUSION_MARKERS.search(sentence) else 0.0
+        score += 1.5 if i >= len(sentences) - 2 else 0.0
+        score += 0.5 if i == 0 else 0.0
+        scored.append((score, -i, i, sentence))
+    kept = []
+    used = estimate_tokens("[Condensed] ")
+    for _, _, i, sentence in sorted(scored, reverse=True):
+        cost = estimate_tokens(sentence) + 1
+        if used + cost <= max_tokens:
+            kept.append((i, sentence))
+            used += cost
+    if not kept:
+        # Not even one sentence fits; fall back to the tail, where the conclusion usually is
+        return "[Condensed] ..." + text[-max(1, max_tokens) * 4:]
+    return "[Condensed] " + " ".join(sentence for _, sentence in sorted(kept))
+
+
+def fit_prompt(build, problem, inputs, budget):
+    # Builds the prompt from the earlier stages' outputs; if it would exceed budget tokens, the
+    # outputs are compacted. Room is shared out so short outputs stay whole and long ones give way.
+    messages = build(problem, inputs)
+    used = estimate_prompt_tokens(messages)
+    if budget is None or used <= budget:
+        return messages
+    items = [(role, i, text) for role, texts in inputs.items() for i, text in enumerate(texts)]
+    sizes = {(role, i): estimate_tokens(text) for role, i, text in items}
+    room = budget - (used - sum(sizes.values()))
+    allowance = {}
+    remaining = sorted(items, key=lambda item: sizes[item[:2]])
+    while remaining:
+        share = max(32, room // len(remaining))
+        role, i, text = remaining.pop(0)
+        allowance[(role, i)] = min(sizes[(role, i)], share)
+        room -= allowance[(role, i)]
+    compacted = {role: [compact(text, allowance[(role, i)]) for i, text in enumerate(texts)] for role, texts in inputs.items()}
+    return build(problem, compacted)
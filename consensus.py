@@ -0,0 +1,146 @@
+import re
+import time
+from collections import Counter
+from math import comb
+
+from compaction import CONCLUSION_MARKERS, _sentences
+from pipeline import ROLES, Stage, build_stages, red_team_pipeline, run_stages
+
+LOCKED = re.compile(r"\b(lock(ed|s)?( up)?|jam(med|s)?|seize(d)? up|(unable to|cannot|can't|won't|not be able to|will not) (rotate|turn|move)|impossible|paradox)\b")
+DIRECTION = re.compile(r"\b(counter-?clockwise|anti-?clockwise|clockwise)\b")
+NUMBER = re.compile(r"\b(?:answer|result|total|solution) (?:is|=|of)\s*:?\s*(-?\d+(?:\.\d+)?)")
+YES_NO = re.compile(r"^(?:the answer is\s*)?(yes|no)\b")
+
+
+# A claim right after one of these is denied ("doesn't lock", "is not clockwise")
+NEGATED = re.compile(r"(\b(not|never|cannot)|n't)\s+(\w+\s+)?$")
+# A sentence calling something wrong is reporting the claim it attacks, not making one
+REJECTS = re.compile(r"\b(wrong|incorrect|mistaken|flawed|not correct)\b")
+
+
+def _normalize(sentence):
+    # The claim that comes last in the sentence ("since gear 1 turns clockwise, gear 7 turns
+    # counterclockwise"; "it claims the gears lock, but gear 7 turns clockwise"). "" when the
+    # sentence denies a claim or calls one wrong, None when it has none.
+    sentence = sentence.lower()
+    if REJECTS.search(sentence):
+        return ""
+    found = [(m.end(), m.start(), "locked") for m in LOCKED.finditer(sentence)]
+    found += [(m.end(), m.start(), "clockwise" if m.group(1) == "clockwise" else "counterclockwise")
+              for m in DIRECTION.finditer(sentence)]
+    found += [(m.end(), m.start(1), m.group(1)) for m in NUMBER.finditer(sentence)]
+    found += [(m.end(), m.start(1), m.group(1)) for m in YES_NO.finditer(sentence)]
+    if not found:
+        return None
+    _, start, claim = max(found)
+    return "" if NEGATED.search(sentence[:start]) else claim
+
+
+def extract_claim(text):
+    # A short normalized form of a stage's conclusion ("locked", "counterclockwise", "42", "yes"),
+    # or None when no recognisable claim is found. Unrecognised outputs never count as agreeing.
+    # A closing denial ("in fact they do not lock") ends the search, so the claim it denies
+    # isn't picked up from an earlier sentence.
+    sentences = _sentences(text or "")
+    concluding = [s for s in sentences if CONCLUSION_MARKERS.search(s)]
+    for sentence in list(reversed(sentences[-2:])) + list(reversed(concluding)):
+        claim = _normalize(sentence)
+        if claim is not None:
+            return claim or None
+    return None
+
+
+def leader(claims):
+    counts = Counter(claim for claim in claims if claim is not None)
+    if not counts:
+        return None, 0
+    return counts.most_common(1)[0]
+
+
+def is_clear(claims, confidence):
+    # One-sided sign test: is the leading claim's share convincingly above one half?
+    top, votes = leader(claims)
+    n = len(claims)
+    if top is None:
+        return False
+    p_value = sum(comb(n, k) for k in range(votes, n + 1)) / 2 ** n
+    return p_value <= 1 - confidence
+
+
+class Consensus:
+    # Decides when a red-team run can stop before ReasonerBot: enough solutions share a claim
+    # (threshold is the required share) and every challenge ends up at the claim it attacked.
+
+    def __init__(self, threshold=1.0, min_solutions=2):
+        self.threshold = threshold
+        self.min_solutions = min_solutions
+
+    def decide(self, stages, outputs):
+        solvers = [s for s in stages if s.role == "solver"]
+        challengers = [s for s in stages if s.role == "red_team"]
+        if any(s.name not in outputs for s in solvers + challengers) or len(solvers) < self.min_solutions:
+            return None
+        claims = {s.name: extract_claim(outputs[s.name]) for s in solvers}
+        top, votes = leader(claims.values())
+        if top is None or votes / len(solvers) < self.threshold:
+            return None
+        for challenge in challengers:
+            # RedTeamBot is told to argue the answer is wrong, so only a challenge that still lands on
+            # the claim it attacks counts as agreeing; one with no recognisable claim is an objection
+            if extract_claim(outputs[challenge.name]) != claims[challenge.deps[0]]:
+                return None
+        chosen = next(s for s in solvers if claims[s.name] == top)
+        return {"claim": top, "votes": votes, "solutions": len(solvers), "answer": outputs[chosen.name], "source": chosen.title}
+
+
+def solver_stages(first, count):
+    name, title, prompt = ROLES["solver"]
+    return [Stage(name.format(i=i), title.format(i=i), "solver", (), prompt) for i in range(first, first + count)]
+
+
+def run_adaptive(problem, report, solutions=2, challenges=2, max_solutions=None, confidence=0.9, threshold=1.0, prepare=None,
+                 **options):
+    # The red-team pipeline with two savings:
+    # - sequential self-consistency: solvers are added `solutions` at a time, up to max_solutions,
+    #   until the leading claim is statistically clear (see is_clear);
+    # - early exit: once the challenges are in, Consensus can skip ReasonerBot and the final call.
+    # Yields (stage, output) like run_stages; report is filled with the outcome: "stages" (all
+    # that were planned), "skipped", "calls_saved", "solutions" (how many were sampled), "claims" and,
+    # on early exit, "consensus".
+    # prepare(stages) returns the stages to run in their place (e.g. with inject_fact's note); it
+    # is applied to every solver batch and to the red-team graph, as they are built here.
+    # Remaining keyword arguments are passed to run_stages.
+    max_solutions = max(max_solutions or solutions, solutions)
+    prepare = prepare or (lambda stages: stages)
+    outputs = options.pop("outputs", None) or {}
+    options.setdefault("samples", Counter())
+    # One priority for the whole run, so later solver batches keep the run's place in the queue
+    if options.get("priority") is None:
+        options["priority"] = time.monotonic()
+    planned = prepare(build_stages(red_team_pipeline(max_solutions, challenges)))
+    report.update(stages=planned, skipped=[], calls_saved=0, consensus=None)
+
+    cancel = options.get("cancel")
+    used = 0
+    while used < max_solutions:
+        batch = prepare(solver_stages(used + 1, min(solutions, max_solutions - used)))
+        for stage, output in run_stages(problem, batch, outputs=outputs, **options):
+            yield stage, output
+        used += len(batch)
+        if cancel is not None and cancel.is_set():
+            break
+        if used >= solutions and is_clear([extract_claim(outputs[s.name]) for s in solver_stages(1, used)], confidence):
+            break
+
+    stages = prepare(build_stages(red_team_pipeline(used, challenges)))
+    consensus = Consensus(threshold)
+    if cancel is None or not cancel.is_set():
+        yield from run_stages(problem, stages, outputs=outputs, stop_when=lambda out: consensus.decide(stages, out) is not None,
+                              **options)
+
+    report["solutions"] = used
+    report["claims"] = {s.name: extract_claim(outputs[s.name]) for s in stages if s.name in outputs}
+    report["consensus"] = consensus.decide(stages, outputs)
+    # A cancelled run's missing stages weren't skipped on purpose, so they aren't counted as saved
+    report["skipped"] = [s for s in planned if s.name not in outputs] if cancel is None or not cancel.is_set() else []
+    report["calls_saved"] = len(report["skipped"])
@@ -0,0 +1,257 @@
+import argparse
+import json
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import openai
+
+import llm
+import pipeline
+from cache import ResponseCache, cache_key
+from consensus import extract_claim
+from gears import solve_gears
+from metrics import RunMetrics
+
+GEAR_PROBLEM = ("{count} axles are equally spaced around a circle. A gear is placed on each axle such that each gear is engaged "
+                "with the gear to its left and the gear to its right. The gears are numbered 1 to {count} around the circle. "
+                "If gear {driven} were rotated clockwise, in which direction would gear {asked} rotate?")
+GEAR_ROW = ("{count} gears are placed in a row so that each gear is engaged with the gears next to it. The gears are numbered "
+            "1 to {count} from left to right. If gear {driven} were rotated clockwise, in which direction would gear {asked} rotate?")
+
+DEFAULT_CONFIGS = "direct,repeated:3,perspectives,red_team:2x2,red_team:4x4"
+# Repeat r of a run draws samples from r * SAMPLE_STRIDE on, so repeats never share a response
+SAMPLE_STRIDE = 1000
+
+
+def default_problems():
+    # The gear problem from the examples (its answer is "locked") and variations on it whose
+    # answers come from the exact solver: odd rings lock, even rings and rows alternate
+    problems = []
+    for template, layout, cases in ((GEAR_PROBLEM, "ring", [(7, 3, 7), (6, 3, 6), (8, 2, 5), (5, 1, 3), (9, 4, 8)]),
+                                    (GEAR_ROW, "row", [(6, 2, 5), (7, 1, 7)])):
+        for count, driven, asked in cases:
+            problem = template.format(count=count, driven=driven, asked=asked)
+            problems.append({"id": f"gears-{layout}-{count}-{driven}-{asked}", "problem": problem,
+                             "answer": solve_gears(problem)["answer"]})
+    return problems
+
+
+def read_problems(path):
+    # JSONL with "problem" and either "answer" (compared with the final answer's claim, e.g.
+    # "locked", "counterclockwise", "42", "yes") or "pattern" (a regex the final answer must match)
+    with open(path, encoding="utf-8") as f:
+        rows = [json.loads(line) for line in f if line.strip()]
+    for i, row in enumerate(rows, 1):
+        if "answer" not in row and "pattern" not in row:
+            raise ValueError(f"problem {row.get('id') or i} has neither an answer nor a pattern to check against")
+        row["id"] = str(row.get("id") or i)
+    return rows
+
+
+def check(item, text):
+    if item.get("pattern"):
+        return re.search(item["pattern"], text or "", re.IGNORECASE) is not None
+    return extract_claim(text) == str(item["answer"]).lower()
+
+
+def parse_configs(spec):
+    # "direct,red_team:2x2,repeated:3" -> [{"name", "strategy", "counts"}, ...]; counts are
+    # (solutions, challenges), challenges defaulting to 2
+    configs = []
+    for name in spec.split(","):
+        strategy, _, counts = name.strip().partition(":")
+        if strategy not in pipeline.STRATEGIES:
+            raise ValueError(f"unknown strategy {strategy!r}; pick from {', '.join(pipeline.STRATEGIES)}")
+        solutions, _, challenges = counts.partition("x")
+        configs.append({"name": name.strip(), "strategy": strategy, "counts": (int(solutions or 2), int(challenges or 2))})
+    return configs
+
+
+class Recording:
+    # Every request the evaluation makes, one JSONL line each: its key, outputs, model, token
+    # usage and seconds. Live runs append to it. A replay answers from it without any network
+    # and reports the recorded usage. Each recorded delay is slept, scaled by speed, so the graph
+    # overlaps as it did live and wall time can be scaled back.
+
+    def __init__(self, path=None, replay=False, speed=0.1):
+        self.path = path
+        self.replay = replay
+        self.speed = speed
+        self._calls = {}
+        self._lock = threading.Lock()
+        if path and os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        call = json.loads(line)
+                    except ValueError:
+                        continue  # a line cut short by a crash
+                    self._calls[call["key"]] = call
+        if replay and not self._calls:
+            raise ValueError(f"nothing recorded in {path}")
+
+    def call(self, messages, temperature, sample=0, stats=None, n=None, model=llm.MODEL, run=None, **kwargs):
+        # Same interface as chatgpt_prompt. run names the evaluation run: two configs can send
+        # the same request and get different answers, and each replay must see its own.
+        stats = {} if stats is None else stats
+        key = f"{run}:{cache_key(model, temperature, messages, sample)}x{n or 1}"
+        if self.replay:
+            with self._lock:
+                recorded = self._calls.get(key)
+            if recorded is None:
+                raise KeyError(f"no recorded {model} response for this request; record it with --record first")
+            time.sleep(recorded["seconds"] * self.speed)
+            stats.update(model=recorded["model"], prompt_tokens=recorded["prompt_tokens"],
+                         completion_tokens=recorded["completion_tokens"])
+            return recorded["outputs"] if n else recorded["outputs"][0]
+        started = time.perf_counter()
+        # fresh: the point is to measure real calls, not the response cache
+        result = llm.chatgpt_prompt(messages, temperature, sample=sample, fresh=True, stats=stats, n=n, model=model, **kwargs)
+        call = {"key": key, "outputs": result if n else [result], "model": model, "seconds": round(time.perf_counter() - started, 3),
+                "prompt_tokens": stats.get("prompt_tokens", 0), "completion_tokens": stats.get("completion_tokens", 0)}
+        with self._lock:
+            self._calls[key] = call
+            if self.path:
+                with open(self.path, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(call, ensure_ascii=False) + "\n")
+        return result
+
+
+class _Samples(Counter):
+    # run_stages' sample counter, starting at offset instead of 0
+    def __init__(self, offset):
+        super().__init__()
+        self.offset = offset
+
+    def __missing__(self, key):
+        return self.offset
+
+
+def evaluate_one(item, config, repeat, call, time_scale=1.0):
+    run_metrics = RunMetrics(run_id=f"{item['id']}/{config['name']}/{repeat}")
+    # One entry per API request: folded samples share a request, escalations add one
+    sent = []
+
+    def counted(*args, **kwargs):
+        sent.append(1)
+        return call(*args, run=run_metrics.run_id, **kwargs)
+
+    stages = pipeline.build_stages(pipeline.STRATEGIES[config["strategy"]][1](*config["counts"]))
+    record = {"id": item["id"], "config": config["name"], "repeat": repeat}
+    started = time.perf_counter()
+    try:
+        outputs = {stage.name: output for stage, output in pipeline.run_stages(
+            item["problem"], stages, call=counted, metrics=run_metrics, samples=_Samples(repeat * SAMPLE_STRIDE))}
+        final = outputs[stages[-1].name]
+        record.update(claim=extract_claim(final), correct=check(item, final))
+    except Exception as e:
+        record.update(claim=None, correct=False, error=f"{type(e).__name__}: {e}")
+    totals = run_metrics.totals()
+    record.update(calls=len(sent), tokens=totals["prompt_tokens"] + totals["completion_tokens"],
+                  cost_usd=totals["cost_usd"], seconds=round((time.perf_counter() - started) * time_scale, 3))
+    return record
+
+
+def pareto(rows):
+    # Names of the configs no other config beats on accuracy, mean cost and mean wall time at once
+    def dominates(a, b):
+        no_worse = a["accuracy"] >= b["accuracy"] and a["cost_usd"] <= b["cost_usd"] and a["seconds"] <= b["seconds"]
+        return no_worse and (a["accuracy"], -a["cost_usd"], -a["seconds"]) != (b["accuracy"], -b["cost_usd"], -b["seconds"])
+    return {row["config"] for row in rows if not any(dominates(other, row) for other in rows)}
+
+
+def summarize(records, configs):
+    rows = []
+    for config in configs:
+        runs = [r for r in records if r["config"] == config["name"]]
+        if not runs:
+            continue
+        rows.append({
+            "config": config["name"],
+            "runs": len(runs),
+            "errors": sum(1 for r in runs if r.get("error")),
+            "accuracy": round(sum(r["correct"] for r in runs) / len(runs), 3),
+            "calls": round(sum(r["calls"] for r in runs) / len(runs), 2),
+            "tokens": round(sum(r["tokens"] for r in runs) / len(runs)),
+            "cost_usd": round(sum(r["cost_usd"] for r in runs) / len(runs), 5),
+            "seconds": round(sum(r["seconds"] for r in runs) / len(runs), 2),
+        })
+    frontier = pareto(rows)
+    for row in rows:
+        row["frontier"] = row["config"] in frontier
+    return sorted(rows, key=lambda row: (row["cost_usd"], row["seconds"]))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure accuracy against cost and time for pipeline configurations.")
+    parser.add_argument("--problems", help="JSONL with 'problem' and 'answer' or 'pattern' (default: gear problems)")
+    parser.add_argument("--configs", default=DEFAULT_CONFIGS,
+                        help="comma-separated strategy[:SOLUTIONS[xCHALLENGES]], e.g. direct,red_team:2x2")
+    parser.add_argument("--samples", type=int, default=5, help="runs of each problem per configuration")
+    parser.add_argument("--workers", type=int, default=8, help="runs evaluated at once")
+    parser.add_argument("--max-in-flight", type=int, default=pipeline.MAX_IN_FLIGHT, help="cap on concurrent API requests")
+    parser.add_argument("--record", help="append every response to this file so the evaluation can be replayed")
+    parser.add_argument("--replay", help="answer from a file written by --record instead of calling the API")
+    parser.add_argument("--replay-speed", type=float, default=0.1,
+                        help="fraction of each recorded delay to wait when replaying; wall times are scaled back")
+    parser.add_argument("--mock", action="store_true", help="call an in-process mock_openai instead of the real API")
+    parser.add_argument("--results", help="append one line per run to this file")
+    parser.add_argument("--json", help="also write the summary to this file")
+    args = parser.parse_args(argv)
+
+    if args.record and args.replay:
+        parser.error("--record and --replay are exclusive")
+    if args.replay and args.replay_speed <= 0:
+        parser.error("--replay-speed must be above 0")
+    problems = read_problems(args.problems) if args.problems else default_problems()
+    configs = parse_configs(args.configs)
+    recording = Recording(args.replay or args.record, replay=bool(args.replay), speed=args.replay_speed)
+    time_scale = 1 / args.replay_speed if args.replay else 1.0
+    pipeline.set_max_in_flight(args.max_in_flight)
+    if args.mock or args.replay:
+        # Mock text would land in the shared disk cache under the same keys as real answers
+        llm.response_cache = ResponseCache(None)
+    if args.mock:
+        from mock_openai import start_mock
+        server, _ = start_mock()
+        openai.api_base = server.url
+        openai.api_key = "sk-mock"
+
+    tasks = [(item, config, repeat) for item in problems for config in configs for repeat in range(args.samples)]
+    print(f"{len(problems)} problems x {len(configs)} configs x {args.samples} samples = {len(tasks)} runs"
+          f"{' (replayed)' if args.replay else ''}", file=sys.stderr)
+    records = []
+    out = open(args.results, "a", encoding="utf-8") if args.results else None
+    try:
+        with ThreadPoolExecutor(max_workers=args.workers) as pool:
+            futures = [pool.submit(evaluate_one, item, config, repeat, recording.call, time_scale) for item, config, repeat in tasks]
+            for count, future in enumerate(as_completed(futures), 1):
+                record = future.result()
+                records.append(record)
+                if out:
+                    out.write(json.dumps(record, ensure_ascii=False) + "\n")
+                    out.flush()
+                if record.get("error"):
+                    print(f"[{count}/{len(tasks)}] {record['id']} {record['config']} failed: {record['error']}", file=sys.stderr)
+    finally:
+        if out:
+            out.close()
+
+    rows = summarize(records, configs)
+    print(f"{'config':<16} {'accuracy':>8} {'calls':>6} {'tokens':>7} {'cost $':>8} {'wall s':>7}  frontier")
+    for row in rows:
+        print(f"{row['config']:<16} {row['accuracy']:>8.1%} {row['calls']:>6} {row['tokens']:>7} {row['cost_usd']:>8.4f} "
+              f"{row['seconds']:>7}  {'*' if row['frontier'] else ''}" + (f"  ({row['errors']} errors)" if row["errors"] else ""))
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"configs": rows, "runs": records}, f, indent=2)
+    return 1 if any(row["errors"] for row in rows) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
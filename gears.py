@@ -0,0 +1,126 @@
+import re
+from collections import deque
+
+from pipeline import with_note
+from similarity import NUMBER_WORDS
+
+NUMBER = r"(\d+|" + "|".join(NUMBER_WORDS) + r")"
+DIRECTION = r"(counter-?clockwise|anti-?clockwise|clockwise)"
+
+RING = re.compile(rf"{NUMBER} (?:axles|gears|cogs|wheels)\b[^.]*\b(?:circle|ring|loop)")
+ROW = re.compile(rf"{NUMBER} (?:axles|gears|cogs|wheels)\b[^.]*\b(?:row|line|chain)")
+NEIGHBOURS = re.compile(r"\b(engag\w*|mesh\w*|interlock\w*|in contact|touch\w*)\b[^.]*\b(left|right|neighbou?rs?|next to|adjacent|either side)")
+MESH = re.compile(rf"gears? {NUMBER} (?:is |are )?(?:engaged|meshe?[sd]?|interlocks?|in contact) with (?:gears? )?{NUMBER}")
+BELT = re.compile(rf"gears? {NUMBER} (?:is |are )?(?:connected|linked|joined) (?:to|with) (?:gears? )?{NUMBER} by (?:a |an )?(crossed |twisted )?(?:belt|chain)")
+DRIVEN = re.compile(rf"gear {NUMBER} (?:were|was|is|are|gets)? ?(?:rotated|turned|rotates|turns|spun|spins|driven|moved) {DIRECTION}")
+ASKED = re.compile(rf"(?:direction|way)[^.?]*gear {NUMBER}|gear {NUMBER} (?:would |will )?(?:rotate|turn|spin|move)")
+# Only a question about which way a gear turns is one this can answer
+DIRECTION_QUESTION = re.compile(r"\b(?:which|what) (?:direction|way)\b|\bclockwise or\b")
+# Anything that changes the layout or asks about something other than direction: leave it to the model
+UNREADABLE = re.compile(r"\b(?:remov\w*|missing|broken|break\w*|slip\w*|teeth|tooth|rpm|speed\w*|how fast|how many)\b")
+
+
+def _number(word):
+    return int(NUMBER_WORDS.get(word, word))
+
+
+def _direction(word):
+    return "clockwise" if word.replace("-", "") == "clockwise" else "counterclockwise"
+
+
+def solve_parity(nodes, constraints, fixed):
+    # Two-colouring with "same"/"differ" edges: constraints are (a, b, differ). fixed is
+    # (node, value) with value 0 or 1. Returns (values, parents, conflict): values for every node
+    # reachable from the fixed one, the BFS tree, and the first edge that can't be satisfied
+    # (an odd cycle of "differ" edges) or None.
+    graph = {node: [] for node in nodes}
+    for a, b, differ in constraints:
+        graph[a].append((b, differ))
+        graph[b].append((a, differ))
+    start, value = fixed
+    values, parents = {start: value}, {start: None}
+    todo = deque([start])
+    while todo:
+        node = todo.popleft()
+        for other, differ in graph[node]:
+            expected = values[node] ^ differ
+            if other not in values:
+                values[other] = expected
+                parents[other] = node
+                todo.append(other)
+            elif values[other] != expected:
+                return values, parents, (node, other)
+    return values, parents, None
+
+
+def parse_gears(problem):
+    # {"gears", "constraints", "driven", "direction", "asked", "layout"} or None if the problem
+    # isn't a gear-rotation question this can read with confidence
+    text = problem.lower()
+    if UNREADABLE.search(text):
+        return None
+    questions = [q for q in re.split(r"(?<=[.?!])\s+", text) if DIRECTION_QUESTION.search(q)]
+    driven, asked = DRIVEN.search(text), [a for q in questions for a in ASKED.findall(q)]
+    if not driven:
+        return None
+    driven_gear, direction = _number(driven.group(1)), _direction(driven.group(2))
+    asked = [_number(a or b) for a, b in asked if _number(a or b) != driven_gear]
+    if not asked:
+        return None
+    constraints = []
+    layout = None
+    for pattern, closed in ((RING, True), (ROW, False)):
+        match = pattern.search(text)
+        if match and NEIGHBOURS.search(text):
+            count = _number(match.group(1))
+            constraints = [(i, i + 1, True) for i in range(1, count)]
+            if closed and count > 2:
+                constraints.append((count, 1, True))
+            layout = f"a ring of {count} gears" if closed else f"a row of {count} gears"
+            break
+    constraints += [(_number(a), _number(b), True) for a, b in MESH.findall(text)]
+    # A straight belt keeps the direction, a crossed one reverses it
+    constraints += [(_number(a), _number(b), bool(crossed)) for a, b, crossed in BELT.findall(text)]
+    linked = {gear for a, b, _ in constraints for gear in (a, b)}
+    if driven_gear not in linked or asked[0] not in linked:
+        return None  # a gear number the layout doesn't mention; better to leave it to the model
+    gears = sorted(linked)
+    return {"gears": gears, "constraints": constraints, "driven": driven_gear, "direction": direction,
+            "asked": asked[0], "layout": layout or f"{len(gears)} connected gears"}
+
+
+def solve_gears(problem):
+    # The verified answer to a gear-rotation problem, or None if it can't be parsed:
+    # {"answer": "clockwise" | "counterclockwise" | "locked" | "undetermined", "fact": str, "parsed": {...}}
+    parsed = parse_gears(problem)
+    if parsed is None:
+        return None
+    driven, asked = parsed["driven"], parsed["asked"]
+    values, parents, conflict = solve_parity(parsed["gears"], parsed["constraints"],
+                                             (driven, 0 if parsed["direction"] == "clockwise" else 1))
+    if conflict is not None:
+        answer = "locked"
+        fact = (f"The gears form {parsed['layout']}. Meshed gears must turn in opposite directions, but the gears "
+                f"linked to gear {driven} include a closed loop with an odd number of meshes (through gears "
+                f"{conflict[0]} and {conflict[1]}), so no assignment of directions works: the gears lock and "
+                f"none of them, gear {asked} included, can turn.")
+    elif asked not in values:
+        answer = "undetermined"
+        fact = f"Gear {asked} isn't connected to gear {driven}, so turning gear {driven} doesn't move it."
+    else:
+        answer = "clockwise" if values[asked] == 0 else "counterclockwise"
+        path, node = [], asked
+        while node is not None:
+            path.append(node)
+            node = parents[node]
+        fact = (f"The gears form {parsed['layout']} and the directions are consistent. Following the chain "
+                f"{' → '.join(str(gear) for gear in reversed(path))} from gear {driven} turning {parsed['direction']}, "
+                f"gear {asked} turns {answer}.")
+    return {"answer": answer, "fact": fact, "parsed": parsed}
+
+
+def inject_fact(stages, verified):
+    # RedTeamBot and ReasonerBot get the exact result as a fact to check the solutions against
+    return with_note(stages, ("red_team", "reasoner"),
+                     f' \n\n A separate exact solver, which models the gears as a graph and checks it step by step, '
+                     f'has verified the following: {verified["fact"]} \n\n')
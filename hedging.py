@@ -0,0 +1,121 @@
+import queue
+import threading
+import time
+from collections import deque
+
+
+class Hedger:
+    # Cuts tail latency by sending a slow call twice. Latencies are learned per key (stage role,
+    # model) over the last window calls. Once a key has min_samples, a call still running at the
+    # percentile gets a duplicate request and whichever answers first is used. The loser can't be
+    # aborted mid-request, so it's left to finish in the background. It is then discarded (a
+    # stream is closed) and timed, so the latency saved is measured, not guessed.
+    # budget caps hedges as a fraction of all calls, which caps the extra spend about the same.
+
+    def __init__(self, enabled=False, percentile=0.95, budget=0.05, window=200, min_samples=20, min_delay=0.5):
+        self.enabled = enabled
+        self.percentile = percentile
+        self.budget = budget
+        self.window = window
+        self.min_samples = min_samples
+        self.min_delay = min_delay
+        self._latencies = {}
+        self._stages = {}
+        self._calls = 0
+        self._hedges = 0
+        self._lock = threading.Lock()
+
+    def delay(self, key):
+        # Seconds to wait before hedging a call for key, or None while there are too few samples
+        with self._lock:
+            latencies = self._latencies.get(key)
+            if latencies is None or len(latencies) < self.min_samples:
+                return None
+            ordered = sorted(latencies)
+        return max(self.min_delay, ordered[min(len(ordered) - 1, int(self.percentile * len(ordered)))])
+
+    def _observe(self, key, seconds):
+        with self._lock:
+            self._latencies.setdefault(key, deque(maxlen=self.window)).append(seconds)
+
+    def _stage(self, key):
+        # Caller holds the lock
+        return self._stages.setdefault(key[0], {"calls": 0, "hedged": 0, "hedge_wins": 0, "saved_seconds": 0.0,
+                                                "extra_tokens": 0})
+
+    def _allow(self, key):
+        with self._lock:
+            if self._hedges + 1 > self.budget * self._calls:
+                return False
+            self._hedges += 1
+            self._stage(key)["hedged"] += 1
+            return True
+
+    def _attempt(self, key, request, outcomes, which):
+        started = time.perf_counter()
+        try:
+            result, error = request(), None
+        except Exception as e:
+            result, error = None, e
+        finished = time.perf_counter()
+        if error is None:
+            self._observe(key, finished - started)
+        outcomes.put((which, result, error, finished))
+
+    def _settle_loser(self, key, outcomes, won, discard):
+        # Runs once the losing request is back: frees what it holds and books what it cost and saved
+        which, result, error, finished = outcomes.get()
+        if error is not None:
+            return
+        tokens = discard(result) if discard is not None else 0
+        with self._lock:
+            stage = self._stage(key)
+            stage["extra_tokens"] += tokens or 0
+            if which == 0:
+                # The hedge won; the original would have taken until now
+                stage["saved_seconds"] += finished - won
+
+    def call(self, key, request, discard=None, stats=None):
+        # Returns request()'s result, hedged if key's calls have been slow. discard(result) is
+        # called on the loser's result and returns the tokens it used. stats (the call's stats
+        # dict) gets "hedged" and "hedge_won".
+        with self._lock:
+            self._calls += 1
+            self._stage(key)["calls"] += 1
+        delay = self.delay(key) if self.enabled else None
+        if delay is None:
+            started = time.perf_counter()
+            result = request()
+            self._observe(key, time.perf_counter() - started)
+            return result
+        outcomes = queue.Queue()
+        threading.Thread(target=self._attempt, args=(key, request, outcomes, 0), daemon=True).start()
+        try:
+            which, result, error, finished = outcomes.get(timeout=delay)
+        except queue.Empty:
+            if not self._allow(key):
+                which, result, error, finished = outcomes.get()
+            else:
+                threading.Thread(target=self._attempt, args=(key, request, outcomes, 1), daemon=True).start()
+                which, result, error, finished = outcomes.get()
+                if error is not None:
+                    # One failed; the other may still come through
+                    which, result, error, finished = outcomes.get()
+                else:
+                    threading.Thread(target=self._settle_loser, args=(key, outcomes, finished, discard), daemon=True).start()
+                if stats is not None:
+                    stats["hedged"] = True
+                    stats["hedge_won"] = which == 1 and error is None
+                if which == 1 and error is None:
+                    with self._lock:
+                        self._stage(key)["hedge_wins"] += 1
+        if error is not None:
+            raise error
+        return result
+
+    def report(self):
+        # Per stage role: calls, hedged, hedge_rate, hedge_wins, saved_seconds and extra_tokens
+        with self._lock:
+            return {stage: dict(totals, hedge_rate=round(totals["hedged"] / totals["calls"], 4) if totals["calls"] else 0.0,
+                                saved_seconds=round(totals["saved_seconds"], 3))
+                    for stage, totals in sorted(self._stages.items(), key=lambda item: str(item[0]))}
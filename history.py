@@ -0,0 +1,178 @@
+import hashlib
+import json
+import os
+import queue
+import sqlite3
+import sys
+import threading
+import time
+from contextlib import closing
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    run_id TEXT PRIMARY KEY,
+    problem TEXT NOT NULL,
+    problem_hash TEXT NOT NULL,
+    strategy TEXT,
+    started REAL NOT NULL,
+    wall_seconds REAL,
+    prompt_tokens INTEGER,
+    completion_tokens INTEGER,
+    cost_usd REAL,
+    owner TEXT
+);
+CREATE INDEX IF NOT EXISTS runs_problem_hash ON runs (problem_hash, started);
+CREATE INDEX IF NOT EXISTS runs_started ON runs (started);
+CREATE TABLE IF NOT EXISTS stages (
+    run_id TEXT NOT NULL REFERENCES runs (run_id),
+    position INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    title TEXT NOT NULL,
+    role TEXT,
+    messages TEXT,
+    output TEXT,
+    model TEXT,
+    cached INTEGER,
+    queue_seconds REAL,
+    wall_seconds REAL,
+    prompt_tokens INTEGER,
+    completion_tokens INTEGER,
+    cost_usd REAL,
+    PRIMARY KEY (run_id, position)
+);
+"""
+
+RUN_COLUMNS = ["run_id", "problem", "problem_hash", "strategy", "started", "wall_seconds", "prompt_tokens",
+               "completion_tokens", "cost_usd", "owner"]
+STAGE_COLUMNS = ["run_id", "position", "name", "title", "role", "messages", "output", "model", "cached",
+                 "queue_seconds", "wall_seconds", "prompt_tokens", "completion_tokens", "cost_usd"]
+
+
+def problem_hash(problem):
+    return hashlib.sha256(" ".join(problem.split()).encode("utf-8")).hexdigest()
+
+
+class RunHistory:
+    # Every finished run in one SQLite file. record() only queues the run; a background thread
+    # writes whatever has queued up in a single transaction, so the caller never waits on disk.
+    # Reads open their own connection and can run from any thread.
+    # Runs carry an owner (the app's session) and reads given an owner only see that owner's
+    # runs; owner=None reads every run.
+
+    def __init__(self, path, batch_size=64):
+        self.path = path
+        self.batch_size = batch_size
+        self._queue = queue.Queue()
+        self._writer = None
+        self._lock = threading.Lock()
+        with closing(self._connect()) as db:
+            db.executescript(SCHEMA)
+            # Files written before runs had an owner
+            if "owner" not in [row["name"] for row in db.execute("PRAGMA table_info(runs)")]:
+                db.execute("ALTER TABLE runs ADD COLUMN owner TEXT")
+            db.execute("CREATE INDEX IF NOT EXISTS runs_owner ON runs (owner, started)")
+
+    def _connect(self):
+        db = sqlite3.connect(self.path, timeout=30)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.row_factory = sqlite3.Row
+        return db
+
+    def _write_loop(self):
+        db = self._connect()
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                with db:
+                    for run, stages in batch:
+                        db.execute(f"INSERT OR REPLACE INTO runs ({', '.join(RUN_COLUMNS)}) VALUES ({', '.join('?' * len(RUN_COLUMNS))})",
+                                   [run[column] for column in RUN_COLUMNS])
+                        db.executemany(f"INSERT OR REPLACE INTO stages VALUES ({', '.join('?' * len(STAGE_COLUMNS))})",
+                                       [[stage[column] for column in STAGE_COLUMNS] for stage in stages])
+            except sqlite3.Error as e:
+                # Losing history shouldn't take the writer down with it
+                print(f"run history: dropped {len(batch)} runs: {e}", file=sys.stderr)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    def record(self, problem, stages, outputs, run_metrics, strategy=None, owner=None):
+        # stages in display order; only those with an output are kept. run_metrics (a RunMetrics)
+        # supplies the prompts, timings and usage of the stages that made calls.
+        rows = {row["stage"]: row for row in run_metrics.rows()}
+        messages = {record["stage"]: record.get("messages") for record in run_metrics.records}
+        totals = run_metrics.totals()
+        run = {"run_id": run_metrics.run_id, "problem": problem, "problem_hash": problem_hash(problem), "strategy": strategy,
+               "started": run_metrics.started, "wall_seconds": totals["wall_seconds"], "prompt_tokens": totals["prompt_tokens"],
+               "completion_tokens": totals["completion_tokens"], "cost_usd": totals["cost_usd"], "owner": owner}
+        stage_rows = []
+        for position, stage in enumerate(s for s in stages if s.name in outputs):
+            row = rows.get(stage.name, {})
+            stage_rows.append({
+                "run_id": run_metrics.run_id, "position": position, "name": stage.name, "title": stage.title,
+                "role": stage.role, "output": outputs[stage.name],
+                "messages": json.dumps(messages[stage.name], ensure_ascii=False) if messages.get(stage.name) else None,
+                "model": row.get("model"), "cached": int(row.get("cached", False)),
+                "queue_seconds": row.get("queue_seconds"), "wall_seconds": row.get("wall_seconds"),
+                "prompt_tokens": row.get("prompt_tokens"), "completion_tokens": row.get("completion_tokens"),
+                "cost_usd": row.get("cost_usd"),
+            })
+        with self._lock:
+            if self._writer is None:
+                self._writer = threading.Thread(target=self._write_loop, name="run-history", daemon=True)
+                self._writer.start()
+        self._queue.put((run, stage_rows))
+
+    def flush(self):
+        # Blocks until everything recorded so far is on disk
+        self._queue.join()
+
+    def _where(self, problem, owner):
+        clauses, params = [], []
+        if problem is not None:
+            clauses.append("problem_hash = ?")
+            params.append(problem_hash(problem))
+        if owner is not None:
+            clauses.append("owner = ?")
+            params.append(owner)
+        return (" WHERE " + " AND ".join(clauses) if clauses else ""), params
+
+    def runs(self, limit=20, offset=0, problem=None, owner=None):
+        # Newest first, optionally only runs of one problem (matched by hash, so whitespace doesn't matter)
+        where, params = self._where(problem, owner)
+        with closing(self._connect()) as db:
+            return [dict(row) for row in db.execute(f"SELECT * FROM runs{where} ORDER BY started DESC LIMIT ? OFFSET ?",
+                                                    params + [limit, offset])]
+
+    def count(self, problem=None, owner=None):
+        where, params = self._where(problem, owner)
+        with closing(self._connect()) as db:
+            return db.execute(f"SELECT COUNT(*) FROM runs{where}", params).fetchone()[0]
+
+    def load(self, run_id, owner=None):
+        # The run with its stages in display order, or None (also when it belongs to another owner)
+        with closing(self._connect()) as db:
+            run = db.execute("SELECT * FROM runs WHERE run_id = ?", [run_id]).fetchone()
+            if run is not None and owner is not None and run["owner"] != owner:
+                return None
+            if run is None:
+                return None
+            stages = db.execute("SELECT * FROM stages WHERE run_id = ? ORDER BY position", [run_id]).fetchall()
+        run = dict(run)
+        run["stages"] = [dict(stage, messages=json.loads(stage["messages"]) if stage["messages"] else None) for stage in stages]
+        return run
+
+
+def describe(run):
+    # One line for a history listing
+    when = time.strftime("%Y-%m-%d %H:%M", time.localtime(run["started"]))
+    problem = " ".join(run["problem"].split())
+    return f"{when} · {run['strategy'] or '-'} · ${run['cost_usd'] or 0:.4f} · {problem[:80]}{'…' if len(problem) > 80 else ''}"
+
+
+history = RunHistory(os.environ.get("RUN_HISTORY_DB", ".run_history.sqlite3"))
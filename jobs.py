@@ -0,0 +1,119 @@
+import itertools
+import os
+import queue
+import threading
+import time
+import uuid
+
+ACTIVE = ("queued", "running")
+
+
+class Job:
+    # One piece of background work. The worker fills in outputs (stage name -> text), partial
+    # (stage name -> text so far) and info (anything else the page needs); the page only reads.
+
+    def __init__(self, run, args, kwargs):
+        self.id = uuid.uuid4().hex[:12]
+        self.status = "queued"
+        self.error = None
+        self.outputs = {}
+        self.partial = {}
+        self.info = {}
+        self.created = time.time()
+        self.finished = None
+        self.cancelled = threading.Event()
+        self._call = (run, args, kwargs)
+        self._lock = threading.Lock()
+
+    def done(self):
+        return self.status not in ACTIVE
+
+    def cancel(self):
+        # A job still waiting for a worker is finished straight away; a running one stops when
+        # its run next checks cancelled
+        with self._lock:
+            self.cancelled.set()
+            if self.status == "queued":
+                self.status = "cancelled"
+                self.finished = time.time()
+
+    def _start(self):
+        # Called by the worker that took the job; False if it was cancelled while queued
+        with self._lock:
+            if self.cancelled.is_set():
+                return False
+            self.status = "running"
+            return True
+
+
+class JobQueue:
+    # A fixed number of worker threads taking jobs from a bounded queue. submit() raises queue.Full
+    # once max_queued jobs are waiting, so a busy server turns new runs away instead of piling
+    # them up. Finished jobs are kept for retention seconds so pages can still show them.
+
+    def __init__(self, workers=4, max_queued=32, retention=3600):
+        self.workers = workers
+        self.retention = retention
+        self._queue = queue.Queue(maxsize=max_queued)
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._threads = []
+        self._order = itertools.count()
+
+    def _start(self):
+        # Caller holds the lock
+        while len(self._threads) < self.workers:
+            thread = threading.Thread(target=self._work, name=f"job-{next(self._order)}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def _work(self):
+        while True:
+            job = self._queue.get()
+            if not job._start():
+                self._queue.task_done()
+                continue
+            try:
+                run, args, kwargs = job._call
+                run(job, *args, **kwargs)
+                job.status = "cancelled" if job.cancelled.is_set() else "done"
+            except Exception as e:
+                job.error = f"{type(e).__name__}: {e}"
+                job.status = "failed"
+            finally:
+                job.finished = time.time()
+                self._queue.task_done()
+
+    def _prune(self):
+        # Caller holds the lock
+        cutoff = time.time() - self.retention
+        for job_id in [j.id for j in self._jobs.values() if j.finished is not None and j.finished < cutoff]:
+            del self._jobs[job_id]
+
+    def submit(self, run, *args, **kwargs):
+        # Queues run(job, *args, **kwargs) and returns the Job
+        job = Job(run, args, kwargs)
+        with self._lock:
+            self._start()
+            self._prune()
+            self._queue.put_nowait(job)
+            self._jobs[job.id] = job
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def cancel(self, job_id):
+        job = self.get(job_id)
+        if job is not None:
+            job.cancel()
+        return job
+
+    def stats(self):
+        with self._lock:
+            statuses = [job.status for job in self._jobs.values()]
+        return {"queued": statuses.count("queued"), "running": statuses.count("running"), "workers": self.workers}
+
+
+jobs = JobQueue(int(os.environ.get("JOB_WORKERS", 4)), int(os.environ.get("JOB_QUEUE_DEPTH", 32)))
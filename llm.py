@@ -0,0 +1,169 @@
+import itertools
+import os
+
+import openai
+import requests
+
+from cache import ResponseCache, cache_key
+from hedging import Hedger
+from metrics import estimate_prompt_tokens, estimate_tokens
+from ratelimit import RequestScheduler
+
+MODEL = "gpt-4"
+# Completion length isn't known up front; this is what's reserved against the token budget
+COMPLETION_ESTIMATE = 600
+
+
+class _SharedSession(requests.Session):
+    # openai recycles its per-thread session every few minutes by closing it. This one is shared
+    # by every thread, so closing it would drop connections other requests are using.
+    def close(self):
+        pass
+
+
+def _pooled_session(size):
+    session = _SharedSession()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+# One keep-alive pool for the process so stage calls reuse TLS connections. Credentials travel
+# with each request (see Client), never on the connection, so sharing the pool is safe.
+openai.requestssession = _pooled_session(int(os.environ.get("OPENAI_POOL_SIZE", 32)))
+
+
+class Client:
+    # Credentials for one user session, passed with every request instead of being set on the
+    # openai module, so concurrent sessions can't pick up each other's key.
+
+    def __init__(self, api_key, api_base=None, organization=None):
+        self.api_key = api_key
+        self.api_base = api_base
+        self.organization = organization
+
+    def options(self):
+        options = {"api_key": self.api_key, "api_base": self.api_base, "organization": self.organization}
+        return {name: value for name, value in options.items() if value}
+
+
+response_cache = ResponseCache(os.environ.get("RESPONSE_CACHE_DIR", ".response_cache"))
+
+scheduler = RequestScheduler(
+    requests_per_minute=int(os.environ.get("OPENAI_RPM", 200)),
+    tokens_per_minute=int(os.environ.get("OPENAI_TPM", 40000)),
+    retryable=(openai.error.RateLimitError, openai.error.APIError, openai.error.Timeout, openai.error.TryAgain,
+               openai.error.ServiceUnavailableError, openai.error.APIConnectionError),
+)
+
+# Off unless HEDGE_REQUESTS=1: a call slower than HEDGE_PERCENTILE of its stage's recent calls
+# is sent again, for at most HEDGE_BUDGET of all calls
+hedger = Hedger(
+    enabled=os.environ.get("HEDGE_REQUESTS") == "1",
+    percentile=float(os.environ.get("HEDGE_PERCENTILE", 95)) / 100,
+    budget=float(os.environ.get("HEDGE_BUDGET", 0.05)),
+)
+
+
+def _cached_samples(prompt, temperature, sample, count, fresh, model=MODEL):
+    # Samples sample .. sample+count-1 are cached separately; returns their keys, what the cache
+    # already holds (None where it doesn't) and the positions still to fetch.
+    keys = [cache_key(model, temperature, prompt, sample + i) for i in range(count)]
+    results = [None] * count if fresh else [response_cache.get(key) for key in keys]
+    return keys, results, [i for i, result in enumerate(results) if result is None]
+
+
+def chatgpt_prompt(prompt, temperature, sample=0, fresh=False, stats=None, priority=0.0, client=None, n=None, model=MODEL,
+                   stage=None):
+    # fresh skips the cache lookup for runs that want new samples; the result is still stored.
+    # stats, if given, is a dict that gets the model, token usage and whether the cache answered.
+    # priority orders requests waiting on the rate limit, lowest first.
+    # client carries the session's credentials; without one the openai module settings are used.
+    # With n, returns a list of n samples drawn by a single request (n choices).
+    # model defaults to MODEL; cheaper models suit helper calls such as routing.
+    # stage (the stage role) groups the call's latency for hedging.
+    stats = {} if stats is None else stats
+    stats["model"] = model
+    keys, results, missing = _cached_samples(prompt, temperature, sample, n or 1, fresh, model)
+    if not missing:
+        stats["cached"] = True
+        return results if n else results[0]
+    estimate = estimate_prompt_tokens(prompt, model) + COMPLETION_ESTIMATE * len(missing)
+
+    def request():
+        return scheduler.call(lambda: openai.ChatCompletion.create(
+        model=model,
+        temperature=temperature,
+        messages=prompt,
+        **({"n": len(missing)} if len(missing) > 1 else {}),
+        **(client.options() if client else {})), estimate, priority)
+
+    def discard(completion):
+        usage = completion.get("usage") or {}
+        used = usage.get("prompt_tokens", 0) + usage.get("completion_tokens", 0)
+        scheduler.settle(estimate, used)
+        return used
+
+    completion = hedger.call((stage, model), request, discard, stats)
+    for position, choice in zip(missing, sorted(completion["choices"], key=lambda c: c.get("index", 0))):
+        results[position] = choice["message"]["content"]
+        response_cache.set(keys[position], results[position])
+    usage = completion.get("usage") or {}
+    stats["prompt_tokens"] = usage.get("prompt_tokens", 0)
+    stats["completion_tokens"] = usage.get("completion_tokens", 0)
+    scheduler.settle(estimate, stats["prompt_tokens"] + stats["completion_tokens"])
+    return results if n else results[0]
+
+
+def chatgpt_stream(prompt, temperature, sample=0, fresh=False, stats=None, priority=0.0, client=None, n=None, model=MODEL,
+                   stage=None):
+    # Same as chatgpt_prompt but yields the completion piece by piece as it's generated.
+    # With n, yields (index, delta) pairs for the n samples instead of bare deltas.
+    # Streamed responses carry no usage block, so token counts are estimated locally.
+    stats = {} if stats is None else stats
+    stats["model"] = model
+    keys, results, missing = _cached_samples(prompt, temperature, sample, n or 1, fresh, model)
+    for position, result in enumerate(results):
+        if result is not None:
+            yield (position, result) if n else result
+    if not missing:
+        stats["cached"] = True
+        return
+    stats["prompt_tokens"] = estimate_prompt_tokens(prompt, model)
+    estimate = stats["prompt_tokens"] + COMPLETION_ESTIMATE * len(missing)
+    # Errors surface before the first chunk, so retries never replay text already yielded
+
+    def request():
+        # Hedging races the first chunk: whichever stream starts first is the one followed
+        response = scheduler.call(lambda: openai.ChatCompletion.create(
+        model=model,
+        temperature=temperature,
+        messages=prompt,
+        stream=True,
+        **({"n": len(missing)} if len(missing) > 1 else {}),
+        **(client.options() if client else {})), estimate, priority)
+        return next(response, None), response
+
+    def discard(started):
+        close = getattr(started[1], "close", None)
+        if close is not None:
+            close()
+        scheduler.settle(estimate, stats["prompt_tokens"])
+        return stats["prompt_tokens"]
+
+    first, response = hedger.call((stage, model), request, discard, stats)
+    chunks = {position: [] for position in missing}
+    for chunk in itertools.chain([first] if first is not None else [], response):
+        choice = chunk["choices"][0]
+        delta = choice["delta"].get("content")
+        if delta:
+            position = missing[choice.get("index", 0)]
+            chunks[position].append(delta)
+            yield (position, delta) if n else delta
+    stats["completion_tokens"] = 0
+    for position, pieces in chunks.items():
+        results[position] = "".join(pieces)
+        stats["completion_tokens"] += estimate_tokens(results[position], model)
+        response_cache.set(keys[position], results[position])
+    scheduler.settle(estimate, stats["prompt_tokens"] + stats["completion_tokens"])
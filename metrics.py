@@ -0,0 +1,198 @@
+import json
+import os
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+# USD per 1K (prompt, completion) tokens
+PRICES = {
+    "gpt-4": (0.03, 0.06),
+    "gpt-4-32k": (0.06, 0.12),
+    "gpt-3.5-turbo": (0.0015, 0.002),
+    "gpt-3.5-turbo-16k": (0.003, 0.004),
+}
+
+_encoders = {}
+
+
+def estimate_tokens(text, model="gpt-4"):
+    if tiktoken is None:
+        return max(1, len(text) // 4) if text else 0
+    if model not in _encoders:
+        try:
+            _encoders[model] = tiktoken.encoding_for_model(model)
+        except KeyError:
+            _encoders[model] = tiktoken.get_encoding("cl100k_base")
+    return len(_encoders[model].encode(text))
+
+
+def estimate_prompt_tokens(messages, model="gpt-4"):
+    # ~4 tokens of framing per message plus 3 to prime the reply, as in OpenAI's cookbook
+    return sum(estimate_tokens(m["content"], model) + 4 for m in messages) + 3
+
+
+def cost(model, prompt_tokens, completion_tokens):
+    prompt_price, completion_price = PRICES.get(model, PRICES["gpt-4"])
+    return (prompt_tokens * prompt_price + completion_tokens * completion_price) / 1000
+
+
+class RunMetrics:
+    # Per-stage records for one pipeline run. run_stages fills in the timings, the call layer
+    # fills in model, tokens and whether the answer came from the cache.
+
+    def __init__(self, run_id=None):
+        self.run_id = run_id or uuid.uuid4().hex[:12]
+        self.started = time.time()
+        self.records = []
+        self._lock = threading.Lock()
+
+    def stage(self, stage, messages=None):
+        # messages is the prompt as sent, kept for the run history
+        record = {"stage": stage.name, "role": stage.role, "submitted": time.perf_counter(),
+                  "model": None, "prompt_tokens": 0, "completion_tokens": 0, "cached": False, "messages": messages}
+        with self._lock:
+            self.records.append(record)
+        return record
+
+    def rows(self):
+        rows = []
+        for record in self.records:
+            if "finished" not in record:
+                continue
+            prompt_tokens, completion_tokens = record["prompt_tokens"], record["completion_tokens"]
+            rows.append({
+                "run_id": self.run_id,
+                "stage": record["stage"],
+                "role": record["role"],
+                "model": record["model"],
+                "cached": record["cached"],
+                "batch_size": record.get("batch_size", 1),
+                "escalation": record.get("escalation", 0),
+                "hedged": record.get("hedged", False),
+                "queue_seconds": round(record["started"] - record["submitted"], 3),
+                "wall_seconds": round(record["finished"] - record["started"], 3),
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "cost_usd": 0.0 if record["cached"] else round(cost(record["model"], prompt_tokens, completion_tokens), 5),
+            })
+        return rows
+
+    def totals(self):
+        rows = self.rows()
+        return {
+            "run_id": self.run_id,
+            "stages": len(rows),
+            "cached": sum(r["cached"] for r in rows),
+            "prompt_tokens": sum(r["prompt_tokens"] for r in rows),
+            "completion_tokens": sum(r["completion_tokens"] for r in rows),
+            "cost_usd": round(sum(r["cost_usd"] for r in rows), 5),
+            "wall_seconds": round(max((r["finished"] for r in self.records if "finished" in r), default=0)
+                                  - min((r["submitted"] for r in self.records), default=0), 3),
+        }
+
+    def to_jsonl(self):
+        timestamp = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(self.started))
+        return "".join(json.dumps(dict(row, timestamp=timestamp)) + "\n" for row in self.rows())
+
+
+class MetricsRegistry:
+    # Process-wide counters across runs, rendered in the Prometheus text format.
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.runs = 0
+        self.stages = {}
+
+    def observe(self, run):
+        with self._lock:
+            self.runs += 1
+            for row in run.rows():
+                key = (row["role"], row["model"] or "unknown", "true" if row["cached"] else "false")
+                totals = self.stages.setdefault(key, {"count": 0, "hedged": 0, "wall": 0.0, "queue": 0.0, "prompt": 0, "completion": 0,
+                                                      "cost": 0.0})
+                totals["count"] += 1
+                totals["hedged"] += row["hedged"]
+                totals["wall"] += row["wall_seconds"]
+                totals["queue"] += row["queue_seconds"]
+                totals["prompt"] += row["prompt_tokens"]
+                totals["completion"] += row["completion_tokens"]
+                totals["cost"] += row["cost_usd"]
+
+    def render(self):
+        lines = [
+            "# HELP pipeline_runs_total Completed pipeline runs.",
+            "# TYPE pipeline_runs_total counter",
+            f"pipeline_runs_total {self.runs}",
+        ]
+        metrics = [
+            ("pipeline_stage_calls_total", "counter", "Stage calls.", "count"),
+            ("pipeline_stage_hedged_total", "counter", "Stage calls sent a second time because they were slow.", "hedged"),
+            ("pipeline_stage_wall_seconds_total", "counter", "Time spent in stage calls.", "wall"),
+            ("pipeline_stage_queue_seconds_total", "counter", "Time stages waited for a free slot.", "queue"),
+            ("pipeline_stage_prompt_tokens_total", "counter", "Prompt tokens sent.", "prompt"),
+            ("pipeline_stage_completion_tokens_total", "counter", "Completion tokens received.", "completion"),
+            ("pipeline_stage_cost_usd_total", "counter", "Estimated spend.", "cost"),
+        ]
+        with self._lock:
+            for name, kind, help_text, field in metrics:
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} {kind}")
+                for (role, model, cached), totals in sorted(self.stages.items()):
+                    lines.append(f'{name}{{role="{role}",model="{model}",cached="{cached}"}} {totals[field]:g}')
+        return "\n".join(lines) + "\n"
+
+    def write(self, path):
+        tmp = f"{path}.tmp"
+        with open(tmp, "w") as f:
+            f.write(self.render())
+        os.replace(tmp, path)
+
+
+registry = MetricsRegistry()
+
+_server = None
+
+
+def start_metrics_server(port, host="0.0.0.0"):
+    # Serves registry.render() on /metrics; only one server per process.
+    global _server
+    if _server is not None:
+        return _server
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = registry.render().encode()
+            self.send_response(200 if self.path.startswith("/metrics") else 404)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    _server = ThreadingHTTPServer((host, port), Handler)
+    _server.daemon_threads = True
+    threading.Thread(target=_server.serve_forever, daemon=True).start()
+    return _server
+
+
+def export(run, jsonl_path=None, prom_path=None):
+    # Called once a run finishes. Paths default to METRICS_JSONL / METRICS_PROM_FILE, and
+    # METRICS_PORT starts a /metrics endpoint the first time through.
+    registry.observe(run)
+    jsonl_path = jsonl_path or os.environ.get("METRICS_JSONL")
+    prom_path = prom_path or os.environ.get("METRICS_PROM_FILE")
+    if jsonl_path:
+        with open(jsonl_path, "a") as f:
+            f.write(run.to_jsonl())
+    if prom_path:
+        registry.write(prom_path)
+    if os.environ.get("METRICS_PORT"):
+        start_metrics_server(int(os.environ["METRICS_PORT"]))
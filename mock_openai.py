@@ -0,0 +1,152 @@
+import argparse
+import json
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+WORDS = "the gears are arranged in a closed loop so each neighbour turns the opposite way and with an odd count the loop cannot close".split()
+
+
+class MockSettings:
+    # Latencies are in seconds. error_rate returns 500s, rate_limit_rate returns 429s with Retry-After.
+    def __init__(self, ttft=0.3, per_token=0.01, jitter=0.1, completion_tokens=200, error_rate=0.0,
+                 rate_limit_rate=0.0, retry_after=1):
+        self.ttft = ttft
+        self.per_token = per_token
+        self.jitter = jitter
+        self.completion_tokens = completion_tokens
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.retry_after = retry_after
+
+
+class MockState:
+    def __init__(self, settings):
+        self.settings = settings
+        self.requests = 0
+        self.errors = 0
+        self.rate_limited = 0
+        self.lock = threading.Lock()
+
+    def count(self, field):
+        with self.lock:
+            setattr(self, field, getattr(self, field) + 1)
+
+
+def _jittered(settings, seconds):
+    return max(0.0, seconds * (1 + random.uniform(-settings.jitter, settings.jitter)))
+
+
+def _prompt_tokens(messages):
+    # Rough local estimate, good enough for a usage block
+    return sum(len(m.get("content", "")) for m in messages) // 4 + 4 * len(messages)
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    state = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        body = json.loads(self.rfile.read(length) or b"{}")
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            return self._json(404, {"error": {"message": f"Unknown path {self.path}", "type": "invalid_request_error"}})
+        state, settings = self.state, self.state.settings
+        state.count("requests")
+        roll = random.random()
+        if roll < settings.rate_limit_rate:
+            state.count("rate_limited")
+            return self._json(429, {"error": {"message": "Rate limit reached (mock)", "type": "requests"}},
+                              {"Retry-After": str(settings.retry_after)})
+        if roll < settings.rate_limit_rate + settings.error_rate:
+            state.count("errors")
+            return self._json(500, {"error": {"message": "The server had an error (mock)", "type": "server_error"}})
+
+        n = body.get("n") or 1
+        # Each choice starts at a random point in WORDS so separate samples differ, like real ones do
+        offsets = [random.randrange(len(WORDS)) for _ in range(n)]
+        words = [[WORDS[(offset + i) % len(WORDS)] + " " for offset in offsets] for i in range(settings.completion_tokens)]
+        usage = {"prompt_tokens": _prompt_tokens(body.get("messages", [])), "completion_tokens": settings.completion_tokens * n}
+        usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+        base = {"id": f"chatcmpl-{uuid.uuid4().hex[:12]}", "created": int(time.time()), "model": body.get("model", "gpt-4")}
+
+        time.sleep(_jittered(settings, settings.ttft))
+        if body.get("stream"):
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            try:
+                for step in words:
+                    for index, word in enumerate(step):
+                        self._chunk(dict(base, object="chat.completion.chunk", choices=[{"index": index, "delta": {"content": word}, "finish_reason": None}]))
+                    time.sleep(_jittered(settings, settings.per_token))
+                for index in range(n):
+                    self._chunk(dict(base, object="chat.completion.chunk", choices=[{"index": index, "delta": {}, "finish_reason": "stop"}]))
+                self._write_chunk(b"data: [DONE]\n\n")
+                self._write_chunk(b"")
+            except (BrokenPipeError, ConnectionResetError):
+                self.close_connection = True  # the client abandoned the stream
+            return
+        time.sleep(_jittered(settings, settings.per_token * settings.completion_tokens))
+        choices = [{"index": i, "message": {"role": "assistant", "content": "".join(step[i] for step in words).strip()}, "finish_reason": "stop"} for i in range(n)]
+        self._json(200, dict(base, object="chat.completion", choices=choices, usage=usage))
+
+    def _json(self, status, payload, headers=None):
+        data = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _chunk(self, payload):
+        self._write_chunk(f"data: {json.dumps(payload)}\n\n".encode())
+
+    def _write_chunk(self, data):
+        self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+        self.wfile.flush()
+
+
+def start_mock(settings=None, host="127.0.0.1", port=0):
+    # Serves in a daemon thread; returns (server, state). The base URL is server.url.
+    state = MockState(settings or MockSettings())
+    handler = type("BoundMockHandler", (MockHandler,), {"state": state})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    server.url = f"http://{host}:{server.server_address[1]}/v1"
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, state
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Local stand-in for the OpenAI ChatCompletion API.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--ttft", type=float, default=0.3, help="seconds before the first token")
+    parser.add_argument("--per-token", type=float, default=0.01, help="seconds per generated token")
+    parser.add_argument("--jitter", type=float, default=0.1, help="relative +/- jitter on every delay")
+    parser.add_argument("--completion-tokens", type=int, default=200)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0)
+    parser.add_argument("--retry-after", type=int, default=1)
+    args = parser.parse_args(argv)
+    settings = MockSettings(args.ttft, args.per_token, args.jitter, args.completion_tokens, args.error_rate,
+                            args.rate_limit_rate, args.retry_after)
+    server, _ = start_mock(settings, args.host, args.port)
+    print(f"Mock OpenAI API on {server.url} (set openai.api_base to this)")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
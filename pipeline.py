@@ -0,0 +1,515 @@
+import asyncio
+import heapq
+import itertools
+import json
+import os
+import queue
+import re
+import threading
+import time
+from collections import Counter, namedtuple
+from concurrent.futures import Future
+
+from compaction import CONCLUSION_MARKERS, fit_prompt
+from llm import chatgpt_prompt
+
+SOLVER_SYSTEM = 'You are ProblemSolver. To start, you state all the fundamental facts of the problem you\'re tackling. You then reason about the best approach to take and potential pitfalls. Once you\'ve figured out an approach, you go through your reasoning step-by-step as you work through it.'
+RED_TEAM_SYSTEM = 'You are RedTeamBot, an AI that is designed to challenge answers to problems. Instead of agreeing, you try to consider why an approach may be wrong - looking for uninuitive and non-obvious reasons for this.\n'
+REASONER_SYSTEM = 'You are ReasonerBot, an advanced AI designed to tackle complex challenges and provide innovative solutions. You summarise all the information you\'ve been given and make your own determinations based on this.'
+FINAL_SYSTEM = 'You are ProblemSolver, an advanced AI designed to tackle evaluate information and determine a good, final answer.'
+VISUAL_SYSTEM = 'You are VisualSolver. You start by drawing the problem as an ASCII diagram, labelling every part of it. You then use the diagram to work through the problem step-by-step, checking each step against the picture.'
+
+
+def solution_prompt(problem):
+    return [{'role': 'system', 'content': SOLVER_SYSTEM}] + [{'role': 'user', 'content': f'What follows is a problem presented by a user: {problem} \n\n'}]
+
+
+def challenge_prompt(problem, solution):
+    return [{'role': 'system', 'content': RED_TEAM_SYSTEM}] + [{'role': 'user', 'content': f'What follows is a problem presented by a user - assume that no relevant information is omitted from this problem:\n\n  {problem} \n\n What follows is a solutions to your problem: \n\n {solution} \n\n In their solution, they missed something and, as a result, are wrong. What do you think fail to consider?  Why is this answer wrong as a result? \n\n'}]
+
+
+def reasoning_prompt(problem, solutions, challenges):
+    solution_text = ' \n\n '.join(solutions)
+    challenge_text = ' \n\n '.join(f'Challenge #{i}: \n\n {challenge}' for i, challenge in enumerate(challenges, 1))
+    return [{'role': 'system', 'content': REASONER_SYSTEM}] + [{'role': 'user', 'content': f'What follows is a tough problem: {problem} \n\n Here are {len(solutions)} solutions to your problem: \n\n {solution_text} \n\n However, we asked {len(challenges)} others to challenge these solutions. Here is their reasoning: \n\n {challenge_text} \n\n Please reason through these answers and challenges to explain why the discrepancy exists. Feel free to dismiss or discount certain perspectives if useful. \n\n'}]
+
+
+def final_prompt(problem, solutions, challenges, reasoning):
+    solution_text = ' \n\n '.join(solutions)
+    challenge_text = ' \n\n And here is the reasoning of '.join(f'Challenge #{i}: \n\n {challenge}' for i, challenge in enumerate(challenges, 1))
+    return [{'role': 'system', 'content': FINAL_SYSTEM}] + [{'role': 'user', 'content': f'What follows is a tough problem: {problem} \n\n Here are {len(solutions)} solutions to your problem: \n\n {solution_text} \n\n However, a 3rd party has challenged these solutions. Here is the reasoning of {challenge_text} \n\n What follows is reasoning to explain why this discrepancy: \n\n {reasoning} \n\n Based on this, what is the best solution to your problem? No need to repeat reasoning. \n\n'}]
+
+
+def direct_prompt(problem):
+    return [{'role': 'user', 'content': problem}]
+
+
+def visual_prompt(problem):
+    return [{'role': 'system', 'content': VISUAL_SYSTEM}] + [{'role': 'user', 'content': f'What follows is a problem presented by a user: {problem} \n\n'}]
+
+
+def judge_prompt(problem, solutions):
+    solution_text = ' \n\n '.join(f'Solution #{i}: \n\n {solution}' for i, solution in enumerate(solutions, 1))
+    return [{'role': 'system', 'content': FINAL_SYSTEM}] + [{'role': 'user', 'content': f'What follows is a tough problem: {problem} \n\n Here are {len(solutions)} solutions to your problem: \n\n {solution_text} \n\n Where they disagree, work out which of them is right. Based on this, what is the best solution to your problem? No need to repeat reasoning. \n\n'}]
+
+
+# Prompt-token budgets for the stages that re-send earlier outputs. Over budget, those outputs
+# are compacted to their key claims (see compaction.fit_prompt) before sending.
+PROMPT_BUDGETS = {
+    "reasoner": int(os.environ.get("REASONER_PROMPT_BUDGET", 4000)),
+    "final": int(os.environ.get("FINAL_PROMPT_BUDGET", 4000)),
+}
+
+
+class _Fitted:
+    # A prompt builder fitted to PROMPT_BUDGETS[budget]; build is kept so with_note can add to it
+    # before fitting
+    def __init__(self, build, budget):
+        self.build = build
+        self.budget = budget
+
+    def __call__(self, problem, inputs):
+        return fit_prompt(self.build, problem, inputs, PROMPT_BUDGETS[self.budget])
+
+
+# Each role knows how to name its stages and build its prompt. The prompt builder gets the
+# problem and the outputs of the stages it depends on, grouped by role.
+ROLES = {
+    "solver": ("solution_{i}", "Solution {i}", lambda problem, inputs: solution_prompt(problem)),
+    "red_team": ("challenge_{i}", "Red Team Challenge #{i}", lambda problem, inputs: challenge_prompt(problem, inputs["solver"][0])),
+    "reasoner": ("reasoning", "Reasoning",
+                 _Fitted(lambda problem, inputs: reasoning_prompt(problem, inputs["solver"], inputs["red_team"]), "reasoner")),
+    "final": ("final_answer", "Final Answer",
+              _Fitted(lambda problem, inputs: final_prompt(problem, inputs["solver"], inputs["red_team"], inputs["reasoner"][0]),
+                      "final")),
+    "direct": ("final_answer", "Answer", lambda problem, inputs: direct_prompt(problem)),
+    "visual": ("visual_{i}", "Visual Perspective {i}", lambda problem, inputs: visual_prompt(problem)),
+    "judge": ("final_answer", "Final Answer",
+              _Fitted(lambda problem, inputs: judge_prompt(problem, inputs.get("solver", []) + inputs.get("visual", [])), "final")),
+}
+
+
+def red_team_pipeline(solutions=2, challenges=2):
+    # "each": one stage of that role per stage here, assigned round-robin.
+    # "all": every stage of those roles.
+    return [
+        {"role": "solver", "count": solutions},
+        {"role": "red_team", "count": challenges, "each": "solver"},
+        {"role": "reasoner", "all": ["solver", "red_team"]},
+        {"role": "final", "all": ["solver", "red_team", "reasoner"]},
+    ]
+
+
+def direct_pipeline(solutions=2, challenges=2):
+    return [{"role": "direct"}]
+
+
+def perspectives_pipeline(solutions=2, challenges=2):
+    # One ordinary and one visual take on the problem, then a call that picks between them
+    return [
+        {"role": "solver", "count": 1},
+        {"role": "visual", "count": 1},
+        {"role": "judge", "all": ["solver", "visual"]},
+    ]
+
+
+def repeated_pipeline(solutions=2, challenges=2):
+    # The same perspective several times; the samples fold into one request
+    return [
+        {"role": "solver", "count": solutions},
+        {"role": "judge", "all": ["solver"]},
+    ]
+
+
+# The strategy graphs a problem can be routed to, cheapest first: name -> (label, spec builder).
+# Every builder takes (solutions, challenges) and ignores what it doesn't use.
+STRATEGIES = {
+    "direct": ("Direct query", direct_pipeline),
+    "perspectives": ("Multiple perspectives", perspectives_pipeline),
+    "repeated": ("Repeated perspectives", repeated_pipeline),
+    "red_team": ("Red Teaming", red_team_pipeline),
+}
+
+
+Stage = namedtuple("Stage", ["name", "title", "role", "deps", "prompt"])
+
+
+def with_note(stages, roles, note):
+    # The same stages, but those of the given roles get note appended to their prompt's last message
+    def noted(build):
+        if isinstance(build, _Fitted):
+            # Noted before fitting, so the note can't push the prompt over its budget
+            return _Fitted(noted(build.build), build.budget)
+
+        def prompt(problem, inputs):
+            messages = build(problem, inputs)
+            return messages[:-1] + [dict(messages[-1], content=messages[-1]["content"] + note)]
+        return prompt
+
+    return [stage._replace(prompt=noted(stage.prompt)) if stage.role in roles else stage for stage in stages]
+
+
+def build_stages(spec):
+    stages = []
+    by_role = {}
+    for step in spec:
+        name, title, prompt = ROLES[step["role"]]
+        count = step.get("count", 1)
+        for i in range(1, count + 1):
+            deps = []
+            if "each" in step:
+                targets = by_role.get(step["each"])
+                if not targets:
+                    raise ValueError(f"{step['role']} needs at least one {step['each']} stage")
+                deps.append(targets[(i - 1) % len(targets)])
+            for role in step.get("all", []):
+                deps.extend(by_role.get(role, []))
+            stage = Stage(name.format(i=i), title.format(i=i), step["role"], tuple(s.name for s in deps), prompt)
+            by_role.setdefault(step["role"], []).append(stage)
+            stages.append(stage)
+    return stages
+
+
+RED_TEAM_STAGES = build_stages(red_team_pipeline())
+
+# Models per role, cheapest first. A stage starts on the first model of its chain and is redone
+# on the next if its output needs_escalation. STAGE_MODELS and STAGE_TEMPERATURES (JSON objects
+# keyed by role) override these; roles without a temperature use run_stages' temperature.
+STAGE_MODELS = {
+    "direct": ["gpt-3.5-turbo", "gpt-4"],
+    "solver": ["gpt-3.5-turbo", "gpt-4"],
+    "visual": ["gpt-3.5-turbo", "gpt-4"],
+    "red_team": ["gpt-3.5-turbo", "gpt-4"],
+    "reasoner": ["gpt-4"],
+    "final": ["gpt-4"],
+    "judge": ["gpt-4"],
+}
+STAGE_MODELS.update(json.loads(os.environ.get("STAGE_MODELS", "{}")))
+STAGE_TEMPERATURES = json.loads(os.environ.get("STAGE_TEMPERATURES", "{}"))
+
+HEDGES = re.compile(r"\b(i'?m not sure|i am not sure|i (cannot|can't|am unable to) (determine|solve|answer|help)|as an ai\b|"
+                    r"not enough information|i don't know)", re.IGNORECASE)
+
+
+def needs_escalation(role, text):
+    # Malformed (empty or only a few words) or low-confidence (hedging, or a solution that never
+    # reaches a conclusion) output from a cheaper model
+    if not text.strip() or (role != "direct" and len(text.split()) < 15):
+        return True
+    if HEDGES.search(text):
+        return True
+    return role in ("solver", "visual", "judge") and not CONCLUSION_MARKERS.search(text)
+
+
+MAX_IN_FLIGHT = int(os.environ.get("PIPELINE_MAX_IN_FLIGHT", 8))
+
+
+class StagePool:
+    # A fixed set of worker threads that take the lowest priority value first (FIFO within a
+    # priority). run_stages passes the run's start time, so a run already under way gets its
+    # later stages in ahead of stages queued by runs that started after it.
+
+    def __init__(self, workers, name="stage"):
+        self._waiting = []
+        self._order = itertools.count()
+        self._cond = threading.Condition()
+        self._closed = False
+        for i in range(workers):
+            threading.Thread(target=self._work, name=f"{name}-{i}", daemon=True).start()
+
+    def submit(self, priority, fn, *args):
+        future = Future()
+        with self._cond:
+            heapq.heappush(self._waiting, (priority, next(self._order), future, fn, args))
+            self._cond.notify()
+        return future
+
+    def _work(self):
+        while True:
+            with self._cond:
+                while not self._waiting and not self._closed:
+                    self._cond.wait()
+                if not self._waiting:
+                    return
+                _, _, future, fn, args = heapq.heappop(self._waiting)
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                future.set_result(fn(*args))
+            except BaseException as e:
+                future.set_exception(e)
+
+    def shutdown(self):
+        # Workers finish what's already queued, then exit
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def set_max_in_flight(limit):
+    global MAX_IN_FLIGHT, _pool
+    with _pool_lock:
+        MAX_IN_FLIGHT = limit
+        old, _pool = _pool, None
+    if old is not None:
+        old.shutdown()
+
+
+def _shared_pool():
+    # One pool for every run in the process, so MAX_IN_FLIGHT caps the total number of
+    # outstanding requests no matter how many runs or how wide the graph is.
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = StagePool(MAX_IN_FLIGHT)
+        return _pool
+
+
+def _inputs(stage, stages, outputs):
+    inputs = {}
+    for other in stages:
+        if other.name in stage.deps:
+            inputs.setdefault(other.role, []).append(outputs[other.name])
+    return inputs
+
+
+def _attempt(call, messages, temperature, kwargs, stages, records, stream_to):
+    # One request for the stages (n choices if there are several); returns their outputs
+    count = len(stages)
+    kwargs = dict(kwargs, n=count) if count > 1 else dict(kwargs)
+    stats = {}
+    if records is not None:
+        kwargs["stats"] = stats
+        started = time.perf_counter()
+        for record in records:
+            record["started"] = started
+    try:
+        if stream_to is None:
+            result = call(messages, temperature, **kwargs)
+            return result if count > 1 else [result]
+        events, cancelled = stream_to
+        texts = [""] * count
+        for item in call(messages, temperature, **kwargs):
+            if cancelled.is_set():
+                break
+            index, delta = item if count > 1 else (0, item)
+            texts[index] += delta
+            events.put(("delta", stages[index], texts[index]))
+        return texts
+    finally:
+        if records is not None:
+            _settle_records(records, stats, time.perf_counter())
+
+
+def _execute(call, messages, temperature, sample, priority, stages, records=None, stream_to=None, metrics=None):
+    # Runs on a pool thread and returns one output per stage. Several stages means they share a
+    # prompt and are drawn as n choices of a single request. records (from RunMetrics) get timings
+    # and usage; stream_to is (events, cancelled) for streaming calls.
+    # The role's STAGE_MODELS chain picks the model; outputs that need_escalation, or a call that
+    # fails outright, are redrawn on the next model in the chain, each retry getting its own
+    # records in metrics.
+    role = stages[0].role
+    models = STAGE_MODELS.get(role) or [None]
+    temperature = STAGE_TEMPERATURES.get(role, temperature)
+    outputs = [None] * len(stages)
+    pending = list(range(len(stages)))
+    for level, model in enumerate(models):
+        kwargs = {"sample": sample, "priority": priority, "stage": role}
+        if model:
+            kwargs["model"] = model
+        group = [stages[i] for i in pending]
+        if level > 0 and metrics is not None:
+            records = [metrics.stage(stage, messages) for stage in group]
+            for record in records:
+                record["escalation"] = level
+        try:
+            results = _attempt(call, messages, temperature, kwargs, group, records, stream_to)
+        except Exception:
+            # A model that's unavailable or still failing after retries falls back to the next one
+            if level == len(models) - 1:
+                raise
+            continue
+        for i, text in zip(pending, results):
+            outputs[i] = text
+        if stream_to is not None and stream_to[1].is_set():
+            break
+        pending = [i for i in pending if needs_escalation(role, outputs[i])]
+        if not pending:
+            break
+    return outputs
+
+
+def _settle_records(records, stats, finished):
+    # The shared prompt is only sent once, so it's charged to the first stage of a batch
+    completion_tokens = stats.get("completion_tokens", 0)
+    share, remainder = divmod(completion_tokens, len(records))
+    for i, record in enumerate(records):
+        record["finished"] = finished
+        record["model"] = stats.get("model")
+        record["cached"] = stats.get("cached", False)
+        record["prompt_tokens"] = stats.get("prompt_tokens", 0) if i == 0 else 0
+        record["completion_tokens"] = share + (remainder if i == 0 else 0)
+        record["batch_size"] = len(records)
+        record["hedged"] = stats.get("hedged", False)
+
+
+def _ready_groups(problem, stages, waiting, outputs, fold_samples):
+    # Takes the stages whose dependencies have finished out of waiting, grouped by prompt:
+    # [(messages, [stage, ...]), ...]
+    groups = {}
+    for stage in [s for s in waiting if all(d in outputs for d in s.deps)]:
+        waiting.remove(stage)
+        messages = stage.prompt(problem, _inputs(stage, stages, outputs))
+        prompt_id = json.dumps(messages, sort_keys=True)
+        if not fold_samples:
+            prompt_id += f"#{stage.name}"
+        groups.setdefault(prompt_id, (messages, []))[1].append(stage)
+    return list(groups.values())
+
+
+class _Run:
+    # The bookkeeping run_stages and arun_stages share: which stages are waiting, running and
+    # finished, the sample counters, and sending ready stages to the shared pool. The drivers
+    # only differ in how they wait for results.
+
+    def __init__(self, problem, stages, call, temperature, metrics, fold_samples, outputs, samples, priority, deltas):
+        self.problem = problem
+        self.stages = stages
+        self.call = call
+        self.temperature = temperature
+        self.metrics = metrics
+        self.fold_samples = fold_samples
+        self.pool = _shared_pool()
+        # Older runs go first when requests queue on the rate limit
+        self.priority = time.monotonic() if priority is None else priority
+        self.outputs = {} if outputs is None else outputs
+        self.waiting = [stage for stage in stages if stage.name not in self.outputs]
+        self.running = {}
+        self.samples = Counter() if samples is None else samples
+        self.cancelled = threading.Event()
+        # Streaming calls put ("delta", stage, text so far) on deltas
+        self.stream_to = (deltas, self.cancelled) if deltas is not None else None
+
+    def submit_ready(self, track):
+        # Submits every stage whose dependencies have finished. track(future) is the driver's
+        # chance to wrap the pool future and get told when it's done; it returns the key that
+        # finish() is later called with.
+        for messages, group in _ready_groups(self.problem, self.stages, self.waiting, self.outputs, self.fold_samples):
+            # Stages that send the same prompt are separate samples, not repeats
+            prompt_id = json.dumps(messages, sort_keys=True)
+            records = [self.metrics.stage(stage, messages) for stage in group] if self.metrics is not None else None
+            future = self.pool.submit(self.priority, _execute, self.call, messages, self.temperature, self.samples[prompt_id],
+                                      self.priority, group, records, self.stream_to, self.metrics)
+            self.samples[prompt_id] += len(group)
+            self.running[track(future)] = group
+        if not self.running:
+            raise ValueError(f"Unresolvable stage dependencies: {[s.name for s in self.waiting]}")
+
+    def finish(self, key):
+        # [(stage, output), ...] for a finished request, recorded in outputs
+        group = self.running.pop(key)
+        finished = list(zip(group, key.result()))
+        for stage, output in finished:
+            self.outputs[stage.name] = output
+        return finished
+
+    def close(self):
+        self.cancelled.set()
+        for future in self.running:
+            future.cancel()
+
+
+def run_stages(problem, stages=RED_TEAM_STAGES, call=chatgpt_prompt, temperature=0.7, on_delta=None, metrics=None,
+               fold_samples=True, outputs=None, samples=None, priority=None, stop_when=None, cancel=None):
+    # Each stage is submitted as soon as its dependencies have finished, so independent
+    # stages overlap. Yields (stage, output) in completion order.
+    # With on_delta, call must be a streaming call (e.g. chatgpt_stream) and on_delta(stage, text)
+    # is invoked from the consuming thread with each stage's text so far.
+    # With metrics (a metrics.RunMetrics), every stage's queue/wall time and token usage is recorded.
+    # With fold_samples, ready stages with identical prompts go out as one request with n choices,
+    # so call must accept n (chatgpt_prompt and chatgpt_stream do).
+    # A run can be split over several calls: outputs holds stages already finished (they are not
+    # re-run, and is updated in place), samples and priority carry over from the earlier call.
+    # stop_when(outputs) is checked as stages finish; once true, nothing else is started.
+    # cancel (a threading.Event) stops the run from another thread: streaming calls break off,
+    # stages not yet started are dropped and the generator returns.
+    events = queue.Queue()
+    run = _Run(problem, stages, call, temperature, metrics, fold_samples, outputs, samples, priority,
+               events if on_delta is not None else None)
+
+    def track(future):
+        future.add_done_callback(lambda f: events.put(("done", f, None)))
+        return future
+
+    try:
+        while run.waiting or run.running:
+            run.submit_ready(track)
+            if cancel is not None:
+                while events.empty() and not cancel.is_set():
+                    cancel.wait(0.1)
+                if cancel.is_set():
+                    return
+            batch = [events.get()]
+            while not events.empty():
+                batch.append(events.get_nowait())
+            # Only the latest text per stage is worth rendering
+            latest = {}
+            finished = []
+            for kind, item, text in batch:
+                if kind == "delta":
+                    latest[item] = text
+                elif item in run.running:
+                    finished.append(item)
+            done_stages = [stage for f in finished for stage in run.running[f]]
+            for stage, text in latest.items():
+                if stage not in done_stages:
+                    on_delta(stage, text)
+            for future in finished:
+                yield from run.finish(future)
+            if stop_when is not None and stop_when(run.outputs):
+                return
+    finally:
+        run.close()
+
+
+class _LoopEvents:
+    # Lets pool threads post stream deltas onto an asyncio queue
+    def __init__(self, loop, events):
+        self.loop = loop
+        self.events = events
+
+    def put(self, item):
+        self.loop.call_soon_threadsafe(self.events.put_nowait, item)
+
+
+async def arun_stages(problem, stages=RED_TEAM_STAGES, call=chatgpt_prompt, temperature=0.7, stream=False, metrics=None,
+                      fold_samples=True, priority=None):
+    # run_stages for an asyncio event loop. Yields ("delta", stage, text so far) while streaming
+    # (call must then be a streaming call) and ("done", stage, output) as stages finish.
+    # Calls still run on the shared stage pool, so one loop can drive many runs while threads are
+    # only held by requests actually in flight. Closing the generator cancels the run.
+    loop = asyncio.get_running_loop()
+    events = asyncio.Queue()
+    run = _Run(problem, stages, call, temperature, metrics, fold_samples, None, None, priority,
+               _LoopEvents(loop, events) if stream else None)
+
+    def track(future):
+        future = asyncio.wrap_future(future, loop=loop)
+        future.add_done_callback(lambda f: events.put_nowait(("done", f, None)))
+        return future
+
+    try:
+        while run.waiting or run.running:
+            run.submit_ready(track)
+            kind, item, text = await events.get()
+            if kind == "delta":
+                yield "delta", item, text
+            elif item in run.running:
+                for stage, output in run.finish(item):
+                    yield "done", stage, output
+    finally:
+        run.close()
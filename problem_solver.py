@@ -1,12 +1,133 @@
+import os
+import queue
+import re
+import uuid
+from functools import partial
+
 import streamlit as st
-import openai
 
-def chatgpt_prompt(prompt, temperature):
-    completion = openai.ChatCompletion.create(
-    model="gpt-4", 
-    temperature=temperature,
-    messages=prompt)
-    return completion["choices"][0]["message"]["content"]
+import metrics
+from consensus import run_adaptive
+from gears import inject_fact, solve_gears
+from history import describe, history
+from jobs import jobs
+from llm import Client, chatgpt_stream, hedger, response_cache
+from metrics import RunMetrics
+from pipeline import STRATEGIES, build_stages, red_team_pipeline, run_stages
+from router import router
+from similarity import seed_stages, similar_runs
+
+EXAMPLES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "examples.md")
+HISTORY_PAGE_SIZE = 10
+# Run history and earlier answers hold visitors' problems, prompts and outputs, so each session
+# only sees its own unless SHARE_RUN_HISTORY=1 (e.g. a private, single-user deployment)
+SHARE_RUN_HISTORY = os.environ.get("SHARE_RUN_HISTORY") == "1"
+
+
+def prepare_stages(stages, earlier=None, verified=None):
+    # The notes a run's prompts carry: the earlier run's answer as a hint, the exact result as a
+    # fact. Applied to the planned stages, and passed to run_adaptive for the stages it builds itself.
+    if earlier is not None:
+        stages = seed_stages(stages, earlier)
+    if verified is not None:
+        stages = inject_fact(stages, verified)
+    return stages
+
+
+def solve_in_background(job, problem, stages, strategy, call, adaptive, seeded, prepare, owner):
+    # Runs on a job worker, so no Streamlit calls: the page reads job.outputs, job.partial and job.info.
+    # adaptive is None or the (solutions, challenges, max_solutions, confidence) for run_adaptive.
+    run_metrics = RunMetrics()
+    job.info["metrics"] = run_metrics
+    options = {"call": call, "on_delta": lambda stage, text: job.partial.__setitem__(stage.name, text),
+               "metrics": run_metrics, "cancel": job.cancelled}
+    if adaptive:
+        report = job.info["report"] = {}
+        results = run_adaptive(problem, report, *adaptive, prepare=prepare, **options)
+    else:
+        results = run_stages(problem, stages, **options)
+    for stage, output in results:
+        job.outputs[stage.name] = output
+    if adaptive and report.get("consensus"):
+        job.outputs["final_answer"] = report["consensus"]["answer"]
+    # Seeded answers lean on another problem's answer, so only unseeded runs are offered for reuse
+    if "final_answer" in job.outputs and not seeded and not job.cancelled.is_set():
+        similar_runs.add(problem, [(stage.name, stage.title, job.outputs[stage.name]) for stage in stages if stage.name in job.outputs], strategy, owner)
+    # Cancelled runs are kept too: their finished stages were paid for
+    history.record(problem, stages, job.outputs, run_metrics, strategy, owner)
+    metrics.export(run_metrics)
+
+
+def show_job(job):
+    if job.info.get("notice"):
+        st.info(job.info["notice"])
+    report = job.info.get("report") or {}
+    for stage in job.info["stages"]:
+        if stage.name in job.outputs:
+            text = job.outputs[stage.name]
+        elif not job.done():
+            text = f"{job.partial[stage.name]}▌" if stage.name in job.partial else "*Waiting...*"
+        else:
+            text = "*Cancelled*" if job.status == "cancelled" else "*Skipped*"
+        st.markdown(f"### {stage.title}\n\n{text}")
+    if not job.done():
+        st.caption("Waiting for a free worker..." if job.status == "queued" else "Running. You can keep using the page; the run carries on.")
+        st.button("Cancel run", on_click=job.cancel)
+        return
+    if job.status == "failed":
+        st.error(f"The run failed: {job.error}")
+    elif job.status == "cancelled":
+        st.warning("Run cancelled. Stages that hadn't started were not sent.")
+    if report.get("consensus"):
+        agreed = report["consensus"]
+        st.success(f"{agreed['votes']} of {agreed['solutions']} solutions concluded **{agreed['claim']}** and every Red Team challenge came back to that conclusion, "
+                   f"so {', '.join(s.title for s in report['skipped'])} {'was' if len(report['skipped']) == 1 else 'were'} skipped "
+                   f"({report['calls_saved']} calls saved). The final answer above is {agreed['source']}.")
+    elif report.get("calls_saved"):
+        st.info(f"The solutions agreed clearly after {report['solutions']} samples, "
+                f"so {report['calls_saved']} extra solutions were skipped.")
+    run_metrics = job.info.get("metrics")
+    if run_metrics is None:
+        # Cancelled before a worker took it, so nothing ran
+        st.markdown("***")
+        return
+    totals = run_metrics.totals()
+    st.markdown("#### Run summary")
+    st.dataframe([{"Stage": row["stage"], "Model": row["model"], "Cached": row["cached"], "Queue (s)": row["queue_seconds"],
+                   "Wall (s)": row["wall_seconds"], "Prompt tokens": row["prompt_tokens"],
+                   "Completion tokens": row["completion_tokens"], "Cost ($)": row["cost_usd"]} for row in run_metrics.rows()])
+    stats = response_cache.stats()
+    escalated = sum(1 for row in run_metrics.rows() if row["escalation"])
+    hedged = sum(1 for row in run_metrics.rows() if row["hedged"])
+    st.caption(f"{totals['wall_seconds']}s end to end, {totals['prompt_tokens'] + totals['completion_tokens']} tokens, "
+               f"~${totals['cost_usd']:.4f}. Response cache: {stats['hits']} hits ({stats['disk_hits']} from disk), {stats['misses']} misses"
+               f"{f'. {escalated} stages were redone on a stronger model' if escalated else ''}"
+               f"{f'. {hedged} slow stages were sent twice' if hedged else ''}")
+    if hedger.enabled and hedged:
+        st.caption("Hedging since the app started: " + "; ".join(
+            f"{stage}: {counts['hedged']} of {counts['calls']} calls, {counts['hedge_wins']} won, "
+            f"{counts['saved_seconds']}s saved, {counts['extra_tokens']} extra tokens"
+            for stage, counts in hedger.report().items() if counts["hedged"]))
+    st.download_button("Download stage metrics (JSON lines)", run_metrics.to_jsonl(), file_name=f"run-{run_metrics.run_id}.jsonl")
+    st.markdown("***")
+
+
+@st.fragment(run_every=0.5)
+def poll_job(job_id):
+    # Redraws only the run's section while it's going; a full rerun once it's finished
+    job = jobs.get(job_id)
+    if job is None or job.done():
+        st.rerun()
+    show_job(job)
+
+
+@st.cache_resource
+def load_examples(path=EXAMPLES_PATH):
+    # Parsed once per process and shared by every session: [(title, markdown), ...]
+    with open(path, encoding="utf-8") as f:
+        parts = re.split(r"^<!-- example: (.+?) -->$", f.read(), flags=re.MULTILINE)
+    return [(title, text.strip()) for title, text in zip(parts[1::2], parts[2::2])]
+
 
 st.markdown("# GPT-4 can reliably solve Yann LeCun's gear problem if given the ability to recognize its limitations & adapt its actions accordingly")
 
@@ -71,421 +192,14 @@ st.write("")
 st.info("You can see how exactly this approch works in [the code](https://github.com/peter942/gpt-4-logical-problem-solving-experiments).")
 st.markdown("And below are 5 examples of it solving Yann's problem with this approach:")
 
-with st.expander("Example #1:"):
-        st.markdown("""### Solution 1
-Fundamental facts:
-
-There are 7 axles equally spaced around a circle.
-Equally-sized gears are placed on each axle.
-Each gear is engaged with the gear to its left and right.
-The gears are numbered 1 to 7 around the circle.
-We are rotating gear 3 clockwise.
-Approach:
-
-Determine the direction of rotation for each gear starting from gear 3 and moving along the circle.
-Identify the direction of rotation for gear 7.
-Potential pitfalls:
-
-Incorrectly determining the direction of rotation for each gear.
-Miscounting the gears.
-Step-by-step reasoning:
-
-Since we are rotating gear 3 clockwise, we now need to determine the direction of rotation for gear 2.
-When gears are engaged, they rotate in the opposite direction of the adjacent gear. So, gear 2 rotates counterclockwise.
-Next, determine the direction of rotation for gear 1. Since gear 2 rotates counterclockwise, gear 1 rotates clockwise.
-Now, determine the direction of rotation for gear 7. Since gear 1 rotates clockwise, gear 7 rotates counterclockwise.
-Therefore, if we rotate gear 3 clockwise, gear 7 would rotate counterclockwise.
-### Solution 2
-Fundamental facts:
-
-There are 7 axles equally spaced around a circle.
-Equally-sized gears are placed on each axle.
-Each gear is engaged with the gear to its left and the gear to its right.
-The gears are numbered 1 to 7 around the circle.
-We are attempting to rotate gear 3 clockwise.
-Approach:
-
-Determine the direction of rotation of each gear, starting from gear 3 and moving in both directions.
-Find the direction of rotation of gear 7.
-Potential Pitfalls:
-
-Skipping a gear in the rotation sequence.
-Misinterpreting the direction of rotation.
-Step-by-step reasoning:
-
-We are rotating gear 3 clockwise.
-Since gear 3 is engaged with gear 2, gear 2 will rotate counter-clockwise.
-Since gear 2 is engaged with gear 1, gear 1 will rotate clockwise.
-Gear 1 is also engaged with gear 7, so gear 7 will rotate counter-clockwise (since gear 1 is rotating clockwise).
-The direction of rotation for gear 7 is counter-clockwise.
-Conclusion: If we attempt to rotate gear 3 clockwise, gear 7 will rotate counter-clockwise.
-
-### Red Team Challenge #1
-In their solution, they failed to consider that the circle of gears will create a closed loop system. In a closed loop system with an odd number of gears, it is impossible for all gears to engage and rotate simultaneously without slipping or breaking. This is because, by the time the rotation reaches the last gear, it will be required to rotate in the same direction as the first gear, creating a contradiction in the rotation direction.
-
-As a result, this answer is wrong because the gears will be unable to rotate in the specified manner. Instead, the gears would either lock up, experience slippage, or break due to the conflicting rotation directions in the closed loop system with an odd number of gears.
-
-### Red Team Challenge #2
-In this solution, they failed to consider the possibility of the gears being locked or unable to rotate due to their arrangement. Since there are an odd number of gears (7) in a closed loop, rotating gear 3 clockwise would require gear 7 to rotate clockwise as well, to maintain engagement with the neighboring gears. However, this creates a contradiction because, as mentioned in the step-by-step reasoning, gear 7 should rotate counter-clockwise when following the rotation sequence from gear 3 to gear 1.
-
-As a result, this answer is wrong because it doesn't take into account the locked nature of the gears in a closed loop with an odd number of gears. The gears would not be able to rotate under normal circumstances, making the determination of gear 7's rotation direction irrelevant.
-
-### Reasoning
-After analyzing the given solutions and challenges, I can determine that the discrepancy exists due to the fact that both solutions failed to consider the implications of having an odd number of gears in a closed loop system.
-
-In a closed loop with an odd number of gears, it is impossible for all gears to engage and rotate simultaneously without slipping or breaking. This is because, by the time the rotation reaches the last gear, it will be required to rotate in the same direction as the first gear, creating a contradiction in the rotation direction.
-
-Both solutions provided the direction of rotation for gear 7 by following the rotation sequence from gear 3 to gear 1 without considering the locked nature of the gears in a closed loop with an odd number of gears. As a result, these solutions are incorrect, as they don't take into account the locked nature of the gears in this particular scenario.
-
-To resolve the discrepancy, it is essential to acknowledge that the gears would not be able to rotate under normal circumstances due to the odd number of gears in a closed loop system. Therefore, determining the direction of rotation for gear 7 is irrelevant in this case, as the gears would either lock, experience slippage, or break due to the conflicting rotation directions.
-
-### Final Answer
-The best solution to the problem is that the gears would be unable to rotate in the specified manner due to the odd number of gears in a closed loop system. This causes a contradiction in the rotation direction, leading to the gears either locking up, experiencing slippage, or breaking. Determining the direction of rotation for gear 7 is irrelevant in this case.""")
-
-with st.expander("Example #2:"):
-        st.markdown("""### Solution 1
-Fundamental facts:
-
-There are 7 axles equally spaced around a circle.
-Equally-sized gears are placed on each axle.
-Each gear is engaged with the gear to its left and the gear to its right.
-The gears are numbered 1 to 7 around the circle.
-Gear 3 is rotated clockwise.
-Approach:
-
-Determine the direction of rotation for each gear, starting with gear 3 and moving towards gear 7.
-Pitfalls:
-
-Assuming that the rotation direction will be the same for all gears, as the direction alternates for adjacent gears.
-Reasoning step-by-step:
-
-Gear 3 is rotated clockwise (given).
-When two engaged gears rotate, they rotate in opposite directions. So, if gear 3 rotates clockwise, gear 4 will rotate counterclockwise.
-Similarly, if gear 4 rotates counterclockwise, gear 5 will rotate clockwise.
-If gear 5 rotates clockwise, gear 6 will rotate counterclockwise.
-Finally, if gear 6 rotates counterclockwise, gear 7 will rotate clockwise, as it is engaged with gear 6.
-Conclusion: If gear 3 is rotated clockwise, gear 7 would rotate in the clockwise direction.
-
-### Solution 2
-Fundamental Facts:
-
-There are 7 axles equally spaced around a circle.
-Equally-sized gears are placed on each axle.
-Each gear is engaged with the gear to its left and the gear to its right.
-Gears are numbered 1 to 7 around the circle.
-Gear 3 is attempted to be rotated clockwise.
-Approach:
-
-Determine the direction of rotation for each gear starting from gear 3 and moving around the circle.
-Identify the direction gear 7 would rotate based on the pattern observed.
-Step 1: Determine the direction of rotation for each gear starting from gear 3.
-
-Gear 3: Clockwise (given)
-Gear 4: When two gears are engaged, they rotate in opposite directions. So, gear 4 would rotate counterclockwise.
-Gear 5: Following the same logic, gear 5 would rotate clockwise.
-Gear 6: Gear 6 would rotate counterclockwise.
-Gear 7: Gear 7 would rotate clockwise.
-Step 2: Identify the direction gear 7 would rotate based on the pattern observed. Based on the pattern observed in Step 1, we can conclude that gear 7 would rotate in a clockwise direction.
-
-### Red Team Challenge #1
-The solution's approach fails to consider that the gears are arranged in a circle. As a result, the conclusion that gear 7 rotates clockwise is incorrect.
-
-Reasoning considering the circular arrangement:
-
-Gear 3 is rotated clockwise (given).
-Gear 4 will rotate counterclockwise, as it is engaged with gear 3.
-Gear 5 will rotate clockwise, as it is engaged with gear 4.
-Gear 6 will rotate counterclockwise, as it is engaged with gear 5.
-Gear 7 will rotate clockwise, as it is engaged with gear 6.
-However, since the gears form a circle, gear 1 is also engaged with gear 7. Since gear 7 is rotating clockwise, gear 1 must rotate counterclockwise.
-Gear 1's counterclockwise rotation will cause gear 2 to rotate clockwise, as it is engaged with gear 1.
-Since gear 2 is engaged with gear 3 and rotating clockwise, it will force gear 3 to rotate counterclockwise, which contradicts the initial clockwise rotation of gear 3.
-This contradiction reveals that the gears cannot rotate freely as described in the problem, as their arrangement would result in a locked system due to the circular configuration. The provided solution is incorrect, as it fails to account for the constraint introduced by the circular arrangement of the gears.
-
-### Red Team Challenge #2
-In this solution, they failed to consider that the gears are arranged in a circle. When gears are engaged in a linear fashion, their rotation directions alternate as described in the solution. However, in a circular arrangement, the situation is different.
-
-When gear 1 is engaged with gear 7, it forms a loop with an odd number of gears (7 in this case). In such a loop, the gears cannot rotate freely as their alternating rotation directions will conflict at the point where gear 1 and gear 7 meet. For example, if gear 3 rotates clockwise, gear 4 rotates counterclockwise, gear 5 rotates clockwise, gear 6 rotates counterclockwise, then gear 7 should rotate clockwise. But for gear 1 to be engaged with gear 7, it must rotate counterclockwise, which contradicts the clockwise rotation of gear 7.
-
-As a result, the gears will be locked and unable to rotate. The answer provided in the solution is incorrect because it assumes the gears can rotate without taking the circular arrangement into account.
-
-### Reasoning
-The discrepancy in the solutions exists because the initial solutions fail to account for the circular arrangement of the gears, as pointed out by the challenges. In a linear arrangement, gears rotate in alternating directions without issue, but a circular arrangement with an odd number of gears creates a locked system. This is because the alternating rotation directions will conflict at the point where the first and last gears meet.
-
-Taking into account the challenges and the circular arrangement, we can reason as follows:
-
-Gear 3 is attempted to be rotated clockwise (given).
-Gear 4 will rotate counterclockwise, as it is engaged with gear 3.
-Gear 5 will rotate clockwise, as it is engaged with gear 4.
-Gear 6 will rotate counterclockwise, as it is engaged with gear 5.
-Gear 7 will rotate clockwise, as it is engaged with gear 6.
-However, since the gears form a circle, gear 1 is also engaged with gear 7. In order for gear 1 to be engaged with gear 7, it must rotate counterclockwise, which contradicts the clockwise rotation of gear 7.
-This contradiction reveals that the gears cannot rotate freely as described in the problem, as their arrangement results in a locked system due to the circular configuration. The initial solutions are incorrect because they assume the gears can rotate without considering the constraint introduced by the circular arrangement of the gears.
-
-The correct conclusion is that the gears will be locked and unable to rotate, as pointed out by the challenges.
-
-### Final Answer
-The best solution to the problem is that the gears will be locked and unable to rotate, as the circular arrangement with an odd number of gears creates a locked system due to the alternating rotation directions conflicting at the point where the first and last gears meet.""")
-
-with st.expander("Example #3:"):
-        st.markdown("""### Solution 1
-Fundamental facts:
-
-There are 7 equally spaced axles around a circle.
-Equally-sized gears are placed on each axle.
-Each gear is engaged with the gear to its left and the gear to its right.
-The gears are numbered 1 to 7 around the circle.
-We are attempting to rotate gear 3 clockwise.
-Objective: Determine the direction of rotation of gear 7.
-
-Approach:
-
-Determine the direction of rotation of each gear starting from gear 3 and going around the circle.
-Observe the pattern of rotation for the gears.
-Apply the pattern to determine the direction of rotation of gear 7.
-Step-by-step reasoning:
-
-Gear 3 is rotated clockwise.
-Since the gears are engaged, gear 4 will rotate counterclockwise.
-Gear 5 will rotate clockwise, as it is engaged with gear 4.
-Gear 6 will rotate counterclockwise, as it is engaged with gear 5.
-Gear 7 will rotate clockwise, as it is engaged with gear 6.
-Conclusion: Gear 7 will rotate in the clockwise direction.
-
-### Solution 2
-Fundamental facts:
-
-There are 7 axles equally spaced around a circle.
-Equally-sized gears are placed on each axle.
-Each gear is engaged with the gear to its left and the gear to its right.
-The gears are numbered 1 to 7 around the circle.
-Gear 3 is rotated clockwise.
-Approach:
-
-Determine the direction of rotation for each gear starting from gear 3 and moving to gear 7.
-Potential pitfalls:
-
-Assuming that the gears rotate in the same direction as their neighbors without considering the effect of gear size.
-Step-by-step reasoning:
-
-Gear 3 is rotated clockwise.
-Since gear 3 is engaged with gear 2, gear 2 will rotate counterclockwise.
-Gear 2 is engaged with gear 1, so gear 1 will rotate clockwise.
-Gear 1 is engaged with gear 7, so gear 7 will rotate counterclockwise.
-Gear 7 is engaged with gear 6, but gear 6 doesn't affect the direction of gear 7.
-Conclusion: If gear 3 is rotated clockwise, gear 7 will rotate counterclockwise.
-
-### Red Team Challenge #1
-The solution provided assumes a simple linear arrangement of gears in which each gear is only engaged with its immediate neighbors. However, in the problem, the gears are arranged in a circle. This arrangement creates a closed loop of gears which affects the rotation pattern.
-
-In a circular arrangement, when the last gear (gear 7) is engaged with the first gear (gear 1), it will affect the rotation pattern. The rotation of gear 7 will be influenced by gear 1, which in turn is influenced by gear 2, and so on.
-
-To illustrate, let's follow the rotation pattern again, considering the engagement between gear 1 and gear 7:
-
-Gear 3 is rotated clockwise.
-Gear 4 rotates counterclockwise.
-Gear 5 rotates clockwise.
-Gear 6 rotates counterclockwise.
-Gear 7 tries to rotate clockwise, as it is engaged with gear 6.
-Gear 1 tries to rotate counterclockwise, as it is engaged with gear 7.
-Gear 2 tries to rotate clockwise, as it is engaged with gear 1.
-However, gear 2 is also engaged with gear 3, which is being rotated clockwise.
-In this circular arrangement, gears 2 and 3 are engaged and are both trying to rotate in the same direction (clockwise). This creates a conflict, as both gears cannot rotate in the same direction simultaneously. As a result, the gears will become locked, and none of the gears will be able to rotate.
-
-The solution provided failed to consider the circular arrangement and the engagement between gear 7 and gear 1, which impacts the rotation pattern. The correct answer should be that the gears will lock up and not rotate.
-
-### Red Team Challenge #2
-In this solution, they failed to consider the possibility of the gears being unable to turn due to their arrangement around the circle. Since there are an odd number of gears (7), and they are equally spaced around the circle, when one gear is rotated, the gear diametrically opposite to it will be forced to rotate in the same direction. However, this is not possible since the gears are engaged with each other, and the movement of one gear causes the adjacent gears to rotate in the opposite direction.
-
-As a result, the answer is wrong because the gears' arrangement would cause a mechanical locking situation, preventing any of the gears from rotating.
-
-### Reasoning
-After reviewing the solutions and challenges provided, it is evident that the discrepancy exists because the initial solutions failed to consider the circular arrangement of the gears and the resulting mechanical locking situation. To resolve this discrepancy, let's dismiss the initial solutions and focus on the challenges, as they provide a more accurate representation of the problem.
-
-Challenge #1 and Challenge #2 both identify the critical issue that arises from the circular arrangement of gears: the gears will lock up and not rotate. When attempting to rotate gear 3 clockwise, the gears' engagement creates a conflict in the rotation pattern, as both gears 2 and 3 cannot rotate in the same direction simultaneously. This mechanical locking situation prevents any of the gears from rotating.
-
-Thus, based on the challenges' reasoning, the answer to the problem is that when gear 3 is rotated clockwise, the gears will lock up and not rotate, making it impossible to determine the rotation direction of gear 7.
-
-### Final Answer
-The best solution to the problem is that when gear 3 is rotated clockwise, the gears will lock up and not rotate, making it impossible to determine the rotation direction of gear 7.  """)
-
-
-with st.expander("Example #4:"):
-     st.markdown("""### Solution 1
-Fundamental facts:
-
-There are 7 axles equally spaced around a circle.
-Equally-sized gears are placed on each axle.
-Each gear is engaged with the gear to its left and the gear to its right.
-The gears are numbered 1 to 7 around the circle.
-Gear 3 is rotated clockwise.
-Approach:
-
-Determine the direction in which gear 2 rotates when gear 3 rotates clockwise.
-Continue this process for each gear up to gear 7.
-Step-by-step reasoning:
-
-When gear 3 rotates clockwise, it causes gear 2 to rotate counterclockwise (opposite direction) since the gears are engaged.
-
-When gear 2 rotates counterclockwise, it causes gear 1 to rotate clockwise (opposite direction).
-
-When gear 1 rotates clockwise, it causes gear 7 to rotate counterclockwise (opposite direction).
-
-Conclusion: If gear 3 is rotated clockwise, gear 7 would rotate counterclockwise.
-
-Solution 2
-### Fundamental facts:
-
-There are 7 axles equally spaced around a circle.
-Equally-sized gears are placed on each axle.
-Each gear is engaged with the gear to its left and the gear to its right.
-The gears are numbered 1 to 7 around the circle.
-Gear 3 is rotated clockwise.
-Approach:
-
-Determine the direction of rotation for each gear starting from gear 3.
-Determine the direction of rotation for gear 7 based on the rotation of the gears around the circle.
-Potential pitfalls:
-
-Incorrectly identifying the direction of gear rotation.
-Step-by-step reasoning:
-
-When gear 3 rotates clockwise, it will cause gear 4 to rotate counterclockwise (due to gears being engaged).
-Gear 4's counterclockwise rotation will cause gear 5 to rotate clockwise.
-Gear 5's clockwise rotation will cause gear 6 to rotate counterclockwise.
-Gear 6's counterclockwise rotation will cause gear 7 to rotate clockwise.
-Conclusion: Gear 7 will rotate clockwise when gear 3 is rotated clockwise.
-
-### Red Team Challenge #1
-The solution assumes that the gears can rotate freely without any restrictions. However, it fails to consider the possibility of mechanical constraints or "locking" due to the circular arrangement of gears.
-
-In a circular arrangement with an odd number of gears (in this case, 7), when gear 3 is rotated clockwise and the rotation is propagated through the gears, gear 7's rotation direction would come into conflict with gear 1. Gear 1 is rotating clockwise, which would force gear 7 to rotate counterclockwise, but gear 6's counterclockwise rotation would force gear 7 to rotate clockwise. This conflict creates a mechanically impossible situation, causing the gears to lock and not rotate at all.
-
-As a result, the answer is wrong because it does not account for the mechanical constraints arising from the circular arrangement with an odd number of gears.
-
-### Red Team Challenge #2
-The solution fails to consider that the gears are arranged in a circle. In a linear arrangement, the reasoning provided would hold true. However, since the gears are in a circle, there is another connection to consider: gear 1 is engaged with gear 7. As a result, the gears' rotations affect each other differently, and the answer may be incorrect.
-
-Here's an alternative step-by-step reasoning that takes the circular arrangement into account:
-
-When gear 3 rotates clockwise, it will cause gear 4 to rotate counterclockwise (due to gears being engaged).
-Gear 4's counterclockwise rotation will cause gear 5 to rotate clockwise.
-Gear 5's clockwise rotation will cause gear 6 to rotate counterclockwise.
-Gear 6's counterclockwise rotation will cause gear 7 to rotate clockwise.
-However, gear 1 is also engaged with gear 7. Following the same logic as before, gear 2 will rotate counterclockwise, gear 1 will rotate clockwise, and gear 7 will be influenced by gear 1's clockwise rotation.
-Due to the circular arrangement of the gears, gear 7 is engaged with both gear 1 and gear 6. As a result, the rotation of gear 7 will be influenced by both of these gears, not just gear 6. The solution's conclusion is incorrect because it fails to consider the effect of gear 1's rotation on gear 7.
-
-### Reasoning
-The discrepancy between the two solutions exists because the first solution takes into account only part of the circular arrangement, while the second solution focuses on the entire circular arrangement.
-
-The first solution's conclusion that gear 7 would rotate counterclockwise is based on the step-by-step reasoning that doesn't consider the engagement of gear 1 and gear 7. It only goes up to gear 1's rotation and then straight to gear 7, ignoring the fact that in a circular arrangement, gear 7 is engaged with both gears 1 and 6.
-
-The second solution's conclusion that gear 7 would rotate clockwise is also incorrect, as it does not take into account the mechanical constraints arising from the circular arrangement with an odd number of gears.
-
-The challenge #1 highlights an essential aspect that both solutions failed to consider - the mechanical constraints due to the circular arrangement of gears with an odd number. This leads to a conflicting situation where gear 7 cannot rotate as it's influenced by both gear 1 and gear 6, which forces it to rotate in opposite directions. Therefore, the gears would lock and not rotate at all.
-
-The challenge #2 emphasizes that the circular arrangement of gears needs to be considered in the reasoning. It is essential to understand that gear 7 is engaged with both gears 1 and 6, and the rotation of gear 7 will be influenced by both of these gears.
-
-In conclusion, the discrepancy exists because both solutions fail to take into account the mechanical constraints arising from the circular arrangement of gears with an odd number. Based on challenge #1, the gears would lock and not rotate at all due to the conflicting rotation directions of gear 7, influenced by both gear 1 and gear 6.
-
-### Final Answer
-The best solution to the problem is that the gears would lock and not rotate at all due to the mechanical constraints arising from the circular arrangement with an odd number of gears, as explained in Challenge #1.
-
-
-     """)
-
-
-with st.expander("Example #5:"):
-    st.markdown("""### Solution 1
-Fundamental facts:
-
-There are 7 axles equally spaced around a circle.
-Equally-sized gears are placed on each axle.
-Each gear is engaged with the gear to its left and the gear to its right.
-The gears are numbered 1 to 7 around the circle.
-Gear 3 is rotated clockwise.
-Approach:
-
-Determine the direction of rotation for each gear starting from gear 3 and moving to gear 7.
-Rotation direction alternates for adjacent gears due to engagement.
-Potential Pitfalls:
-
-Miscounting the gears or their rotation direction.
-Reasoning step-by-step:
-
-Gear 3 is rotated clockwise.
-Since gear 3 engages with gear 4, gear 4 must rotate counter-clockwise.
-Gear 4 engages with gear 5, so gear 5 must rotate clockwise.
-Gear 5 engages with gear 6, so gear 6 must rotate counter-clockwise.
-Finally, gear 6 engages with gear 7, so gear 7 must rotate clockwise.
-Conclusion: Gear 7 will rotate in the clockwise direction.
-
-### Solution 2
-Fundamental facts:
-
-There are 7 axles equally spaced around a circle.
-Equally-sized gears are placed on each axle.
-Each gear engages with the gears to its left and right.
-The gears are numbered 1 to 7.
-Gear 3 is rotated clockwise.
-Approach:
-
-Determine the direction of rotation for each gear from gear 3 to gear 7.
-Observe the pattern and relations between adjacent gears.
-Use the pattern to determine the direction of rotation for gear 7.
-Potential pitfalls:
-
-Assuming that the pattern will always hold without checking each gear's rotation.
-Misinterpreting the direction of rotation or skipping gears in the sequence.
-Step-by-step reasoning:
-
-We start with gear 3 rotating clockwise.
-Since it engages with gear 2, gear 2 will rotate in the opposite direction (counterclockwise).
-Gear 2 engages with gear 1, so gear 1 will rotate in the opposite direction of gear 2 (clockwise).
-Gear 1 engages with gear 7, so gear 7 will rotate in the opposite direction of gear 1 (counterclockwise).
-We can observe that when gears are engaged, they rotate in the opposite direction of the adjacent gear.
-Conclusion: Gear 7 will rotate counterclockwise.
-
-### Red Team Challenge #1
-The solution fails to consider the fact that the gears are arranged in a circle. This circular arrangement means that gear 1 is also engaged with gear 7, which would affect the rotation direction of gear 7.
-
-Let's reconsider the reasoning step-by-step:
-
-Gear 3 is rotated clockwise.
-Since gear 3 engages with gear 4, gear 4 must rotate counter-clockwise.
-Gear 4 engages with gear 5, so gear 5 must rotate clockwise.
-Gear 5 engages with gear 6, so gear 6 must rotate counter-clockwise.
-Gear 6 engages with gear 7, so gear 7 must rotate clockwise.
-However, gear 1 is also engaged with gear 7, which would cause gear 7 to rotate counter-clockwise as gear 1 rotates clockwise due to its engagement with gear 2.
-This creates a contradiction as gear 7 cannot rotate in both clockwise and counter-clockwise directions at the same time. The answer is wrong because it does not account for the circular arrangement and the engagement of gear 7 with gear 1.
-
-### Red Team Challenge #2
-The solution assumes that the gears can be engaged in a way that allows them to rotate without any issues. However, this assumption fails to consider that an odd number of gears arranged in a circle and engaged with each other will lead to a paradox.
-
-If gear 1 rotates clockwise, and gear 2 rotates counterclockwise, then gear 3 should rotate clockwise. Continuing this pattern, when we reach gear 7, it should rotate counterclockwise, as stated in the solution. However, gear 7 is engaged with both gear 1 (clockwise) and gear 6 (counterclockwise). This creates a mechanical paradox, as gear 7 cannot simultaneously rotate in both directions.
-
-Thus, the answer is wrong because it overlooks the mechanical paradox arising from having an odd number of equally-sized gears engaged in a circle. In reality, the gears would become locked and unable to rotate.
-
-Reasoning
-The discrepancy between the two solutions and the challenges exists due to the assumption that the gears can rotate freely without any issues in a circular arrangement with an odd number of gears. The circular arrangement of gears introduces a mechanical paradox, which both initial solutions overlooked.
-
-Upon analyzing the challenges, we find that Challenge #2 correctly identifies the mechanical paradox that arises from having an odd number of equally-sized gears engaged in a circle. In this configuration, the gears will become locked and unable to rotate, as gear 7 cannot rotate in both clockwise and counter-clockwise directions simultaneously.
-
-Challenge #1 also highlights the importance of considering the circular arrangement and engagement of gear 7 with gear 1, which leads to the contradiction mentioned. However, it does not explicitly identify the mechanical paradox, even though it points out the issue arising from the odd number of gears in the circular arrangement.
-
-Therefore, the correct reasoning is as follows:
-
-The gears are arranged in a circle with an odd number of equally-sized gears (7 gears).
-Each gear is engaged with the gears to its left and right.
-When gears are engaged, they rotate in the opposite direction of the adjacent gear.
-Due to the circular arrangement and the odd number of gears, there is a mechanical paradox that arises, causing the gears to become locked and unable to rotate freely.
-Conclusion: The discrepancy exists because both initial solutions failed to consider the mechanical paradox arising from having an odd number of equally-sized gears engaged in a circle. In reality, the gears would become locked and unable to rotate.
-
-### Final Answer
-The best solution to the problem is that the gears would become locked and unable to rotate due to the mechanical paradox arising from having an odd number of equally-sized gears engaged in a circle.
-     
-       """)
+for title, transcript in load_examples():
+    with st.expander(title, key=f"example-{title}", on_change="rerun") as example:
+        # Only the open transcript is sent to the page on each rerun
+        if example.open:
+            st.markdown(transcript)
 st.markdown("As you can see, it solves this problem reliably. Depending on the context and level of risk in getting a solution wrong, you can add additional layers to reduce the margin of error to 0 - for example, by adding more Red Team checkers, or more inital solutions.")
+st.caption("These transcripts are examples, not a measurement. `evaluate.py` runs a set of problems with known answers "
+           "through each approach and reports accuracy against calls, tokens, cost and time.")
 
 
 st.markdown("## Run this yourself:")
@@ -493,33 +207,131 @@ st.write("You can run this yourself in-app by entering your OpenAI API key below
 with st.expander("OpenAI API Key"):
     openai_api_key = st.text_input("OpenAI API Key", type="password")
     if st.button("Set OpenAI API Key"):
-        openai.api_key = openai_api_key
+        st.session_state["client"] = Client(openai_api_key)
         st.success("OpenAI API Key set successfully!")
     st.info("You'll need GPT-4 API access to run this :(")
 
+# Runs are stored under the session's owner id; reads are limited to it unless history is shared
+owner = st.session_state.setdefault("owner", uuid.uuid4().hex)
+visible_to = None if SHARE_RUN_HISTORY else owner
+
 problem = st.text_area("What is your problem?", value="7 axles are equally spaced around a circle. A gear is placed on each axle such that each gear is engaged with the gear to its left and the gear to its right. The gears are numbered 1 to 7 around the circle. If gear 3 were rotated clockwise, in which direction would gear 7 rotate?")
 
-if st.button("Run Process"):
-    solution_1 = chatgpt_prompt([{ 'role': 'system', 'content': 'You are ProblemSolver. To start, you state all the fundamental facts of the problem you\'re tackling. You then reason about the best approach to take and potential pitfalls. Once you\'ve figured out an approach, you go through your reasoning step-by-step as you work through it.'}] + [{'role': 'user', 'content': f'What follows is a problem presented by a user: {problem} \n\n'}], 0.7)
-    st.markdown("### Solution 1")
-    st.markdown(solution_1)
-    solution_2 = chatgpt_prompt([{ 'role': 'system', 'content': 'You are ProblemSolver. To start, you state all the fundamental facts of the problem you\'re tackling. You then reason about the best approach to take and potential pitfalls. Once you\'ve figured out an approach, you go through your reasoning step-by-step as you work through it.'}]  + [{'role': 'user', 'content': f'What follows is a problem presented by a user: {problem} \n\n'}], 0.7)
-    st.markdown("### Solution 2")
-    st.markdown(solution_2)
-    challenge_1 = chatgpt_prompt([{ 'role': 'system', 'content': 'You are RedTeamBot, an AI that is designed to challenge answers to problems. Instead of agreeing, you try to consider why an approach may be wrong - looking for uninuitive and non-obvious reasons for this.\n'}] + [{'role': 'user', 'content': f'What follows is a problem presented by a user - assume that no relevant information is omitted from this problem:\n\n  {problem} \n\n What follows is a solutions to your problem: \n\n {solution_1} \n\n In their solution, they missed something and, as a result, are wrong. What do you think fail to consider?  Why is this answer wrong as a result? \n\n'}], 0.7)
-    st.markdown("### Red Team Challenge #1")
-    st.markdown(challenge_1)
-    challenge_2 = chatgpt_prompt([{ 'role': 'system', 'content': 'You are RedTeamBot, an AI that is designed to challenge answers to problems. Instead of agreeing, you try to consider why an approach may be wrong - looking for uninuitive and non-obvious reasons for this.\n'}] + [{'role': 'user', 'content': f'What follows is a problem presented by a user - assume that no relevant information is omitted from this problem:\n\n  {problem} \n\n What follows is a solutions to your problem: \n\n {solution_2} \n\n In their solution, they missed something and, as a result, are wrong. What do you think fail to consider?  Why is this answer wrong as a result? \n\n'}], 0.7)
-    st.markdown("### Red Team Challenge #2")
-    st.markdown(challenge_2)
-    reasoning = chatgpt_prompt([{ 'role': 'system', 'content': 'You are ReasonerBot, an advanced AI designed to tackle complex challenges and provide innovative solutions. You summarise all the information you\'ve been given and make your own determinations based on this.'}] + [{'role': 'user', 'content': f'What follows is a tough problem: {problem} \n\n Here are 2 solutions to your problem: \n\n {solution_1} \n\n {solution_2} \n\n However, we asked 2 others to challenge these solutions. Here is their reasoning: \n\n Challenge #1: \n\n {challenge_1} \n\n Challenge #2: \n\n {challenge_2} \n\n Please reason through these answers and challenges to explain why the discrepancy exists. Feel free to dismiss or discount certain perspectives if useful. \n\n'}], 0.7)
-    st.markdown("### Reasoning")
-    st.markdown(reasoning)
-    final_answer = chatgpt_prompt([{ 'role': 'system', 'content': 'You are ProblemSolver, an advanced AI designed to tackle evaluate information and determine a good, final answer.'}] + [{'role': 'user', 'content': f'What follows is a tough problem: {problem} \n\n Here are 2 solutions to your problem: \n\n {solution_1} \n\n {solution_2} \n\n However, a 3rd party has challenged these solutions. Here is the reasoning of Challenge #1: \n\n {challenge_1} \n\n And here is the reasoning of Challenge #2: \n\n {challenge_2} \n\n What follows is reasoning to explain why this discrepancy: \n\n {reasoning} \n\n Based on this, what is the best solution to your problem? No need to repeat reasoning. \n\n'}], 0.7)
-    st.markdown("### Final Answer")
-    st.markdown(final_answer)
+# Gear-rotation problems can be solved exactly, for free
+verified = solve_gears(problem)
+exact = False
+if verified:
+    st.success(f"This is a gear problem the exact solver can read: the answer is **{verified['answer']}**.")
+    # Informing by default: the point of the page is to see the model work the problem out
+    exact_mode = st.radio("Use the exact result to", ["answer", "inform", "ignore"], index=1,
+                          format_func={"answer": "Answer directly, without calling the model",
+                                       "inform": "Give the Red Team and Reasoner the result as a verified fact",
+                                       "ignore": "Ignore it"}.get)
+    exact = exact_mode == "answer"
+
+# Earlier runs of the same or a similar problem: offer the answer back only for the same problem
+# (one changed word, like "counterclockwise" or "only", can flip the answer while barely moving
+# the score), and as a hint the solvers can be given otherwise
+reuse = seed = None
+similar = similar_runs.lookup(problem, limit=1, owner=visible_to) if not exact else []
+if similar:
+    earlier = similar[0]
+    if earlier["exact"]:
+        st.success("This exact problem was solved before.")
+        reuse = st.checkbox("Show the earlier answer instead of running again", value=False)
+    else:
+        st.info(f"A similar problem was solved before ({earlier['score']:.0%} similar)"
+                f"{', with different numbers' if not earlier['same_numbers'] else ''}. Its answer may not carry over.")
+        seed = st.checkbox("Give the solvers the earlier answer as a hint", value=False)
+    with st.expander("Earlier problem and answer"):
+        st.markdown(f"{earlier['problem']}\n\n**{earlier['stages'][-1][1]}:** {earlier['stages'][-1][2]}")
+
+strategy_choice = st.selectbox("Approach", ["auto"] + list(STRATEGIES),
+                               format_func=lambda name: "Let the meta-query decide" if name == "auto" else STRATEGIES[name][0],
+                               help="The meta-query picks the cheapest approach it expects to be reliable for the problem.")
+solutions_col, challenges_col = st.columns(2)
+solution_count = solutions_col.number_input("Initial solutions", min_value=1, max_value=8, value=2)
+challenge_count = challenges_col.number_input("Red Team challenges", min_value=1, max_value=8, value=2)
+use_cache = st.checkbox("Reuse cached responses", value=True, help="Untick to draw fresh samples for every stage.")
+adaptive = st.checkbox("Stop early when the solutions and Red Team agree", value=False,
+                       help="Red Teaming only. Skips the Reasoning and Final Answer calls when every solution reaches the same conclusion and every challenge comes back to it.")
+if adaptive:
+    max_col, confidence_col = st.columns(2)
+    max_solutions = max_col.number_input("Max solutions (keep sampling until they clearly agree)", min_value=solution_count, max_value=16, value=solution_count)
+    confidence = confidence_col.slider("Agreement confidence", min_value=0.5, max_value=0.99, value=0.9)
+
+run = st.button("Run Process")
+if run and exact:
+    st.markdown(f"### Final Answer\n\n{verified['fact']}")
+    st.caption("From the exact gear solver; no API calls were made.")
     st.markdown("***")
 
+if run and reuse:
+    for name, title, output in earlier["stages"]:
+        st.markdown(f"### {title}\n\n{output}")
+    st.caption(f"From an earlier run ({earlier['strategy'] or 'unknown'} approach). Untick the box above to run it again.")
+    st.markdown("***")
+
+if run and not reuse and not exact:
+    call = partial(chatgpt_stream, fresh=not use_cache, client=st.session_state.get("client"))
+    strategy = strategy_choice
+    notice = None
+    if strategy == "auto":
+        decision = router.route(problem, client=st.session_state.get("client"))
+        strategy = decision["strategy"]
+        notice = (f"Approach: **{STRATEGIES[strategy][0]}** ({decision['reason']}"
+                  f"{', decision cached' if decision['cached'] else ''}).")
+    adaptive = adaptive and strategy == "red_team"
+    if adaptive:
+        stages = build_stages(red_team_pipeline(max_solutions, challenge_count))
+    else:
+        stages = build_stages(STRATEGIES[strategy][1](solution_count, challenge_count))
+    prepare = partial(prepare_stages, earlier=earlier if seed else None,
+                      verified=verified if verified and exact_mode == "inform" else None)
+    stages = prepare(stages)
+    previous = jobs.get(st.session_state.get("job_id"))
+    if previous is not None:
+        previous.cancel()
+    try:
+        job = jobs.submit(solve_in_background, problem, stages, strategy, call,
+                          (solution_count, challenge_count, max_solutions, confidence) if adaptive else None, bool(seed), prepare, owner)
+        job.info.update(stages=stages, notice=notice)
+        st.session_state["job_id"] = job.id
+    except queue.Full:
+        st.session_state.pop("job_id", None)
+        st.error("The server is busy with other runs right now. Please try again in a minute.")
+
+# The session's latest run keeps going in the background across reruns; this only shows it
+job = jobs.get(st.session_state.get("job_id"))
+if job is not None and not (run and (exact or reuse)):
+    if job.done():
+        show_job(job)
+    else:
+        poll_job(job.id)
+
+with st.expander("Run history", key="run-history", on_change="rerun") as past:
+    # Replays stored runs; nothing here calls the API
+    if past.open:
+        only_this = st.checkbox("Only runs of the problem above", value=False)
+        total = history.count(problem if only_this else None, visible_to)
+        if not total:
+            st.write("No runs yet." if SHARE_RUN_HISTORY else "No runs in this session yet.")
+        else:
+            pages = -(-total // HISTORY_PAGE_SIZE)
+            page = st.number_input(f"Page (of {pages})", min_value=1, max_value=pages, value=1)
+            runs = history.runs(HISTORY_PAGE_SIZE, (page - 1) * HISTORY_PAGE_SIZE, problem if only_this else None, visible_to)
+            chosen = st.radio(f"{total} runs, newest first", runs, format_func=describe, index=None)
+            if chosen:
+                replay = history.load(chosen["run_id"], visible_to)
+                show_prompts = st.checkbox("Show the prompts sent", value=False)
+                st.markdown(f"**Problem:** {replay['problem']}")
+                for stage in replay["stages"]:
+                    st.markdown(f"### {stage['title']}\n\n{stage['output']}")
+                    if show_prompts and stage["messages"]:
+                        st.json(stage["messages"], expanded=False)
+                st.caption(f"{replay['wall_seconds']}s end to end, {(replay['prompt_tokens'] or 0) + (replay['completion_tokens'] or 0)} tokens, "
+                           f"~${replay['cost_usd'] or 0:.4f}. Run {replay['run_id']}.")
+
 st.write("Or, you can run this yourself locally by cloning [this repo](https://github.com/peter942/gpt-4-logical-problem-solving-experiments) and running `streamlit run problem_solver.py`.")
 
 st.markdown("## Extending this approach")
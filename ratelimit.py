@@ -0,0 +1,115 @@
+import heapq
+import itertools
+import random
+import threading
+import time
+
+
+class TokenBucket:
+    # Refills continuously at per_minute / 60 per second up to one minute's worth.
+    # Not thread-safe on its own; RequestScheduler guards it.
+
+    def __init__(self, per_minute):
+        self.rate = per_minute / 60.0
+        self.capacity = float(per_minute)
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, amount, now):
+        # Seconds until amount is available. Anything bigger than the bucket waits for a full one.
+        self._refill(now)
+        amount = min(amount, self.capacity)
+        return 0.0 if self.level >= amount else (amount - self.level) / self.rate
+
+    def take(self, amount):
+        self.level -= amount
+
+    def give(self, amount):
+        self.level = min(self.capacity, self.level + amount)
+
+
+def retry_after(error):
+    headers = getattr(error, "headers", None) or {}
+    value = headers.get("retry-after") or headers.get("Retry-After")
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
+
+
+class RequestScheduler:
+    # Shared gate in front of every API call. Enforces requests-per-minute and tokens-per-minute
+    # budgets, lets the lowest priority value go first (run_stages uses the run's start time, so
+    # runs already in flight finish before new ones start) and retries retryable errors with
+    # jittered exponential backoff, honouring Retry-After.
+
+    def __init__(self, requests_per_minute, tokens_per_minute, retryable=(Exception,), max_retries=6,
+                 base_delay=1.0, max_delay=60.0):
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+        self.retryable = retryable
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.stats = {"requests": 0, "retries": 0, "throttled_seconds": 0.0}
+        self._cond = threading.Condition()
+        self._waiting = []
+        self._order = itertools.count()
+        self._paused_until = 0.0
+
+    def acquire(self, tokens, priority=0.0):
+        entry = (priority, next(self._order))
+        started = time.monotonic()
+        with self._cond:
+            heapq.heappush(self._waiting, entry)
+            try:
+                while True:
+                    now = time.monotonic()
+                    delay = None
+                    if self._waiting[0] == entry:
+                        delay = max(self.requests.delay(1, now), self.tokens.delay(tokens, now), self._paused_until - now)
+                        if delay <= 0:
+                            self.requests.take(1)
+                            self.tokens.take(tokens)
+                            self.stats["requests"] += 1
+                            self.stats["throttled_seconds"] += now - started
+                            return
+                    self._cond.wait(delay)
+            finally:
+                self._waiting.remove(entry)
+                heapq.heapify(self._waiting)
+                self._cond.notify_all()
+
+    def settle(self, estimated, actual):
+        # Correct the token budget once the real usage is known
+        with self._cond:
+            if actual < estimated:
+                self.tokens.give(estimated - actual)
+            else:
+                self.tokens.take(actual - estimated)
+            self._cond.notify_all()
+
+    def call(self, fn, tokens, priority=0.0):
+        attempt = 0
+        while True:
+            self.acquire(tokens, priority)
+            try:
+                return fn()
+            except self.retryable as e:
+                attempt += 1
+                if attempt > self.max_retries:
+                    raise
+                delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+                wait_for = retry_after(e)
+                if wait_for is not None:
+                    delay = max(delay, wait_for)
+                    # The limit is shared, so hold everyone back rather than just this request
+                    with self._cond:
+                        self._paused_until = max(self._paused_until, time.monotonic() + wait_for)
+                with self._cond:
+                    self.stats["retries"] += 1
+                time.sleep(delay)
@@ -0,0 +1,101 @@
+import hashlib
+import os
+import re
+import threading
+from collections import OrderedDict
+
+from llm import chatgpt_prompt
+from pipeline import STRATEGIES
+
+ROUTER_MODEL = os.environ.get("ROUTER_MODEL", "gpt-3.5-turbo")
+
+ROUTER_SYSTEM = 'You are a meta-query that decides how a problem should be solved. You know where language models like yourself tend to go wrong, and you pick the cheapest approach that will still solve the problem reliably.'
+
+# Signals the local classifier looks for
+MECHANISM = re.compile(r"\b(gears?|pulleys?|levers?|belts?|chains?|axles?|cogs?|wheels?|dominoes|mirrors?|rotat\w*|spin\w*|engaged?|meshe?d?)\b")
+PITFALL = re.compile(r"\b(circle|closed|loop|odd|trick\w*|paradox\w*|assume|suppose|if \w+ were|what would|would happen|in which direction|impossible|always|never)\b")
+SPATIAL = re.compile(r"\b(left|right|above|below|behind|in front|north|south|east|west|facing|grid|row|column|square|triangle|shape|diagram|arrange\w*|position\w*|adjacent|between|clockwise|counterclockwise)\b")
+NUMERIC = re.compile(r"\b(how many|how much|calculate|compute|probability|percent|average|total|sum|product|ratio)\b|\d+\s*[-+*/x×^]\s*\d+")
+
+
+def route_prompt(problem):
+    options = " \n ".join(f'- {name}: {description}' for name, description in [
+        ("direct", "directly querying the model. For simple problems, this is the best and most efficient approach."),
+        ("perspectives", "calling on multiple perspectives, e.g. visualising the problem with ASCII as well as solving it normally. For visual or spatial problems."),
+        ("repeated", "calling on the same perspective multiple times and picking the best answer. For problems where the model is likely to be inconsistent, such as multi-step calculations."),
+        ("red_team", "red teaming its own answers and reasoning through the challenges. For problems where the model is likely to fall into a common pitfall or where the answer is unintuitive."),
+    ])
+    return [{'role': 'system', 'content': ROUTER_SYSTEM}] + [{'role': 'user', 'content': f'What follows is a problem presented by a user: {problem} \n\n Which of these approaches should be used to solve it? \n {options} \n\n Reply with the name of the approach only.'}]
+
+
+def classify(problem):
+    # Local, free stand-in for the meta-query: (strategy, reason)
+    text = problem.lower()
+    mechanism, pitfall = MECHANISM.findall(text), PITFALL.findall(text)
+    spatial, numeric = SPATIAL.findall(text), NUMERIC.findall(text)
+    if mechanism and (pitfall or spatial):
+        return "red_team", "looks like a physical mechanism with a likely pitfall"
+    if pitfall and len(text.split()) > 25:
+        return "red_team", "looks like a long problem with a likely pitfall"
+    if len(spatial) >= 2:
+        return "perspectives", "looks like a spatial problem that benefits from a picture"
+    if numeric or len(re.findall(r"\d+", text)) >= 3:
+        return "repeated", "looks like a multi-step calculation where samples may disagree"
+    return "direct", "looks like a simple problem"
+
+
+def parse_route(reply):
+    # The first strategy name the reply mentions, or None
+    reply = reply.lower().replace("red team", "red_team").replace("red-team", "red_team")
+    found = [(reply.find(name), name) for name in STRATEGIES if name in reply]
+    return min(found)[1] if found else None
+
+
+def normalize(problem):
+    return re.sub(r"\s+", " ", problem.strip().lower())
+
+
+class Router:
+    # Picks a strategy per problem, either with the local classifier ("local") or by asking a
+    # cheap model ("llm", falling back to the classifier if the reply names no strategy).
+    # Decisions are kept in a small LRU keyed by the normalised problem; the model's replies are
+    # also in the response cache, so they survive restarts.
+
+    def __init__(self, method="local", model=ROUTER_MODEL, max_entries=4096):
+        self.method = method
+        self.model = model
+        self.max_entries = max_entries
+        self._decisions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _decide(self, problem, call, client):
+        # (strategy, reason, worth caching); a failed meta-query is retried next time
+        if self.method == "llm":
+            try:
+                strategy = parse_route(call(route_prompt(problem), 0, client=client, model=self.model))
+            except Exception as e:
+                strategy, reason = classify(problem)
+                return strategy, f"{reason} (the meta-query failed: {type(e).__name__})", False
+            if strategy:
+                return strategy, f"chosen by the {self.model} meta-query", True
+        return classify(problem) + (True,)
+
+    def route(self, problem, call=chatgpt_prompt, client=None):
+        # Returns {"strategy", "reason", "method", "cached"}
+        key = hashlib.sha256(f"{self.method}:{self.model}:{normalize(problem)}".encode()).hexdigest()
+        with self._lock:
+            if key in self._decisions:
+                self._decisions.move_to_end(key)
+                return dict(self._decisions[key], cached=True)
+        strategy, reason, keep = self._decide(problem, call, client)
+        decision = {"strategy": strategy, "reason": reason, "method": self.method}
+        if not keep:
+            return dict(decision, cached=False)
+        with self._lock:
+            self._decisions[key] = decision
+            while len(self._decisions) > self.max_entries:
+                self._decisions.popitem(last=False)
+        return dict(decision, cached=False)
+
+
+router = Router(os.environ.get("ROUTER_METHOD", "local"))
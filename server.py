@@ -0,0 +1,229 @@
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import sys
+import time
+from functools import partial
+
+import openai
+from aiohttp import web
+
+import metrics
+import pipeline
+from gears import inject_fact, solve_gears
+import llm
+from cache import ResponseCache
+from llm import chatgpt_prompt, chatgpt_stream
+from metrics import RunMetrics
+from router import router
+
+# Problems from one /batch request solved at once
+BATCH_CONCURRENCY = int(os.environ.get("SERVER_BATCH_CONCURRENCY", 8))
+MAX_BATCH = int(os.environ.get("SERVER_MAX_BATCH", 100))
+
+
+class BadRequest(ValueError):
+    pass
+
+
+def read_options(body):
+    # The request fields shared by every endpoint, checked and with defaults filled in
+    strategy = body.get("strategy", "auto")
+    if strategy != "auto" and strategy not in pipeline.STRATEGIES:
+        raise BadRequest(f"strategy must be auto or one of {', '.join(pipeline.STRATEGIES)}")
+    exact = body.get("exact", "inform")
+    if exact not in ("answer", "inform", "off"):
+        raise BadRequest("exact must be answer, inform or off")
+    try:
+        counts = (int(body.get("solutions", 2)), int(body.get("challenges", 2)))
+    except (TypeError, ValueError):
+        raise BadRequest("solutions and challenges must be integers")
+    if not all(1 <= count <= 8 for count in counts):
+        raise BadRequest("solutions and challenges must be between 1 and 8")
+    return {"strategy": strategy, "exact": exact, "counts": counts, "fresh": bool(body.get("fresh", False))}
+
+
+def read_problem(value):
+    problem = value.get("problem") if isinstance(value, dict) else value
+    if not isinstance(problem, str) or not problem.strip():
+        raise BadRequest("problem must be a non-empty string")
+    return problem
+
+
+async def plan(problem, options):
+    # (strategy, stages, verified) the same way batch.solve decides them. verified is the exact
+    # gear solver's result, which answers the problem outright when exact is "answer".
+    verified = solve_gears(problem) if options["exact"] != "off" else None
+    if verified and options["exact"] == "answer":
+        return "exact", [], verified
+    strategy = options["strategy"]
+    if strategy == "auto":
+        # An llm router makes a blocking call of its own
+        strategy = (await asyncio.get_running_loop().run_in_executor(None, router.route, problem))["strategy"]
+    stages = pipeline.build_stages(pipeline.STRATEGIES[strategy][1](*options["counts"]))
+    if verified:
+        stages = inject_fact(stages, verified)
+    return strategy, stages, verified
+
+
+async def solve(problem, options, run_id=None, on_event=None, planned=None):
+    # The result record (as batch.py writes it) for one problem. on_event, if given, is an async
+    # callback getting ("delta", stage, text) and ("done", stage, output) as the run goes, which
+    # also makes the calls streaming. planned is plan()'s result if the caller already has it.
+    started = time.time()
+    run_metrics = RunMetrics(run_id=run_id)
+    record = {"id": run_metrics.run_id, "problem": problem, "stages": {}}
+    strategy, stages, verified = planned or await plan(problem, options)
+    record["strategy"] = strategy
+    if strategy == "exact":
+        record["stages"]["exact"] = record["final_answer"] = verified["fact"]
+    else:
+        call = partial(chatgpt_stream if on_event else chatgpt_prompt, fresh=options["fresh"])
+        # aclosing so a client going away cancels the run's remaining stages straight away
+        async with contextlib.aclosing(pipeline.arun_stages(problem, stages, call=call, stream=on_event is not None,
+                                                            metrics=run_metrics)) as events:
+            async for kind, stage, text in events:
+                if kind == "done":
+                    record["stages"][stage.name] = text
+                if on_event is not None:
+                    await on_event(kind, stage, text)
+        record["final_answer"] = record["stages"].get(stages[-1].name)
+        metrics.export(run_metrics)
+    record["seconds"] = round(time.time() - started, 3)
+    record["usage"] = run_metrics.totals()
+    return record
+
+
+async def read_json(request):
+    try:
+        body = await request.json()
+    except ValueError:
+        raise BadRequest("body must be JSON")
+    if not isinstance(body, dict):
+        raise BadRequest("body must be a JSON object")
+    return body
+
+
+@web.middleware
+async def errors(request, handler):
+    try:
+        return await handler(request)
+    except BadRequest as e:
+        return web.json_response({"error": str(e)}, status=400)
+    except (web.HTTPException, ConnectionResetError):
+        raise
+    except Exception as e:
+        return web.json_response({"error": f"{type(e).__name__}: {e}"}, status=500)
+
+
+async def handle_solve(request):
+    # POST /solve {"problem", "strategy", "exact", "solutions", "challenges", "fresh"}
+    # -> the result record once the run has finished
+    body = await read_json(request)
+    record = await solve(read_problem(body), read_options(body), body.get("id"))
+    return web.json_response(record)
+
+
+def sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n".encode("utf-8")
+
+
+async def handle_stream(request):
+    # POST /solve/stream takes the same body as /solve and answers with server-sent events:
+    # "plan" once, "delta" with each stage's new text ("replace" when a stage starts over on a
+    # stronger model), "stage" as each stage finishes, then "done" with the record or "error".
+    # Disconnecting cancels the run.
+    body = await read_json(request)
+    problem, options = read_problem(body), read_options(body)
+    response = web.StreamResponse(headers={"Content-Type": "text/event-stream", "Cache-Control": "no-cache"})
+    await response.prepare(request)
+    sent = {}
+
+    async def on_event(kind, stage, text):
+        if kind == "delta":
+            previous = sent.get(stage.name, "")
+            if text.startswith(previous):
+                await response.write(sse("delta", {"stage": stage.name, "text": text[len(previous):]}))
+            else:
+                await response.write(sse("delta", {"stage": stage.name, "text": text, "replace": True}))
+            sent[stage.name] = text
+        else:
+            await response.write(sse("stage", {"stage": stage.name, "title": stage.title, "output": text}))
+
+    try:
+        planned = await plan(problem, options)
+        await response.write(sse("plan", {"strategy": planned[0], "stages": [{"stage": s.name, "title": s.title} for s in planned[1]]}))
+        record = await solve(problem, options, body.get("id"), on_event, planned)
+        await response.write(sse("done", record))
+    except (ConnectionResetError, asyncio.CancelledError):
+        raise
+    except Exception as e:
+        await response.write(sse("error", {"error": f"{type(e).__name__}: {e}"}))
+    return response
+
+
+async def handle_batch(request):
+    # POST /batch {"problems": [problem or {"id", "problem"}, ...], ...options} -> {"results": [...]}
+    # in input order. Problems run BATCH_CONCURRENCY at a time; a failed one has an "error".
+    body = await read_json(request)
+    problems = body.get("problems")
+    if not isinstance(problems, list) or not problems:
+        raise BadRequest("problems must be a non-empty list")
+    if len(problems) > MAX_BATCH:
+        raise BadRequest(f"at most {MAX_BATCH} problems per batch")
+    options = read_options(body)
+    items = [(str(p.get("id") or i) if isinstance(p, dict) else str(i), read_problem(p)) for i, p in enumerate(problems, 1)]
+    slots = asyncio.Semaphore(BATCH_CONCURRENCY)
+
+    async def one(item_id, problem):
+        async with slots:
+            try:
+                return await solve(problem, options, item_id)
+            except Exception as e:
+                return {"id": item_id, "problem": problem, "error": f"{type(e).__name__}: {e}"}
+
+    results = await asyncio.gather(*(one(item_id, problem) for item_id, problem in items))
+    return web.json_response({"results": results})
+
+
+async def handle_health(request):
+    return web.json_response({"status": "ok", "strategies": list(pipeline.STRATEGIES), "cache": llm.response_cache.stats(),
+                              "scheduler": llm.scheduler.stats})
+
+
+def make_app():
+    app = web.Application(middlewares=[errors])
+    app.add_routes([
+        web.post("/solve", handle_solve),
+        web.post("/solve/stream", handle_stream),
+        web.post("/batch", handle_batch),
+        web.get("/health", handle_health),
+    ])
+    return app
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve the problem-solving pipeline over HTTP.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--max-in-flight", type=int, default=pipeline.MAX_IN_FLIGHT, help="cap on concurrent API requests")
+    parser.add_argument("--mock", action="store_true", help="answer from an in-process mock_openai instead of the real API")
+    args = parser.parse_args(argv)
+
+    pipeline.set_max_in_flight(args.max_in_flight)
+    if args.mock:
+        from mock_openai import start_mock
+        server, _ = start_mock()
+        openai.api_base = server.url
+        openai.api_key = "sk-mock"
+        # Cache keys don't include the API base, so mock text must never reach the shared disk cache
+        llm.response_cache = ResponseCache(None)
+        print(f"Using the mock OpenAI API on {server.url}", file=sys.stderr)
+    web.run_app(make_app(), host=args.host, port=args.port)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
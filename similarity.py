@@ -0,0 +1,209 @@
+import hashlib
+import itertools
+import json
+import os
+import re
+import threading
+import time
+from collections import Counter, OrderedDict
+
+import numpy as np
+
+from pipeline import with_note
+
+NUMBER_WORDS = {word: str(i) for i, word in enumerate(
+    "zero one two three four five six seven eight nine ten eleven twelve thirteen fourteen fifteen "
+    "sixteen seventeen eighteen nineteen twenty".split())}
+STOPWORDS = set("a an the is are was were be of to in on at by for with and or if as that this it its which what "
+                "would will do does there their they them then than so such each".split())
+
+_PRIME = (1 << 61) - 1
+
+
+def normalize(problem):
+    # Lowercase words with number words turned into digits, so "seven gears" and "7 gears" match
+    words = re.findall(r"[a-z]+|\d+(?:\.\d+)?", problem.lower())
+    return [NUMBER_WORDS.get(word, word) for word in words]
+
+
+def numbers(words):
+    # The numbers in a normalized problem, in order. Two problems that differ only here can have
+    # different answers (7 gears lock, 6 don't), so a match with other numbers is a hint, not an answer.
+    return tuple(word for word in words if word[0].isdigit())
+
+
+def _stem(word):
+    return re.sub(r"(ing|ed|es|s)$", "", word) if len(word) > 4 else word
+
+
+def shingles(problem):
+    # Stemmed content words and word pairs, with numbers masked so they don't affect similarity
+    words = ["#" if word[0].isdigit() else _stem(word) for word in normalize(problem) if word not in STOPWORDS]
+    return set(words) | {f"{a} {b}" for a, b in zip(words, words[1:])}
+
+
+class SimilarityIndex:
+    # Finds earlier runs of near-duplicate problems without any embedding service: MinHash
+    # signatures over shingles(), bucketed by LSH bands so a lookup only scores the few stored
+    # problems sharing a band. Numbers are masked, so variants of one problem share a signature;
+    # entries are grouped by signature and each group is scored once, however many runs it holds.
+    # Runs are appended to a JSONL file (with their signature, so loading doesn't rehash) and
+    # read back from it by offset only when they match.
+    # Runs carry an owner (the app's session); a lookup given an owner only finds that owner's
+    # runs, owner=None finds every run.
+
+    def __init__(self, path=None, permutations=64, bands=16, seed=1, max_candidates=512):
+        self.path = path
+        self.bands = bands
+        self.rows = permutations // bands
+        self.max_candidates = max_candidates
+        rng = np.random.default_rng(seed)
+        self._a = rng.integers(1, _PRIME, permutations, dtype=np.uint64)
+        self._b = rng.integers(0, _PRIME, permutations, dtype=np.uint64)
+        self._signatures = np.empty((0, permutations), dtype=np.uint32)  # one row per group
+        self._groups = {}  # signature bytes -> group
+        self._members = []  # group -> {owner: OrderedDict(numbers -> [entry, ...])}, most recently added last
+        self._count = 0
+        self._offsets = []
+        self._records = []  # only used without a path
+        self._exact = {}  # (owner, normalized problem) -> latest entry
+        self._buckets = [{} for _ in range(bands)]
+        self._lock = threading.Lock()
+        if path and os.path.exists(path):
+            self._load()
+
+    def __len__(self):
+        return self._count
+
+    def signature(self, problem):
+        hashes = np.fromiter((int.from_bytes(hashlib.blake2b(s.encode(), digest_size=8).digest(), "little") >> 4
+                              for s in shingles(problem) or {""}), dtype=np.uint64)
+        # a*x+b over uint64 wraps, which is fine for hashing; the top bits are the best mixed
+        mixed = self._a[:, None] * hashes[None, :] + self._b[:, None]
+        return (mixed.min(axis=1) >> np.uint64(32)).astype(np.uint32)
+
+    def _band_keys(self, signature):
+        raw = signature.tobytes()
+        size = self.rows * signature.itemsize
+        return [raw[i * size:(i + 1) * size] for i in range(self.bands)]
+
+    def _group(self, signature):
+        # Caller holds the lock
+        raw = signature.tobytes()
+        group = self._groups.get(raw)
+        if group is not None:
+            return group
+        group = len(self._members)
+        if group == len(self._signatures):
+            grown = np.empty((max(1024, 2 * group), self._signatures.shape[1]), dtype=np.uint32)
+            grown[:group] = self._signatures[:group]
+            self._signatures = grown
+        self._signatures[group] = signature
+        self._groups[raw] = group
+        self._members.append({})
+        for bucket, key in zip(self._buckets, self._band_keys(signature)):
+            bucket.setdefault(key, []).append(group)
+        return group
+
+    def _index(self, signature, problem, offset, owner):
+        # Caller holds the lock. Every entry is also filed under owner None, which lookups
+        # across all owners use.
+        entry = self._count
+        words = normalize(problem)
+        problem_numbers = numbers(words)
+        group = self._members[self._group(signature)]
+        for key in {owner, None}:
+            members = group.setdefault(key, OrderedDict())
+            members.setdefault(problem_numbers, []).append(entry)
+            members.move_to_end(problem_numbers)
+            self._exact[(key, " ".join(words))] = entry
+        self._offsets.append(offset)
+        self._count += 1
+
+    def _load(self):
+        with open(self.path, "rb") as f:
+            offset = 0
+            for line in f:
+                try:
+                    record = json.loads(line)
+                    signature = np.frombuffer(bytes.fromhex(record["signature"]), dtype=np.uint32)
+                except (ValueError, KeyError):
+                    offset += len(line)
+                    continue  # a line cut short by a crash
+                self._index(signature, record["problem"], offset, record.get("owner"))
+                offset += len(line)
+
+    def _read(self, entry):
+        if self.path is None:
+            return self._records[self._offsets[entry]]
+        with open(self.path, "rb") as f:
+            f.seek(self._offsets[entry])
+            return json.loads(f.readline())
+
+    def add(self, problem, stages, strategy=None, owner=None):
+        # stages: [(name, title, output), ...] in display order; the last is the final answer
+        signature = self.signature(problem)
+        record = {"problem": problem, "strategy": strategy, "stages": [list(stage) for stage in stages],
+                  "timestamp": time.time(), "signature": signature.tobytes().hex(), "owner": owner}
+        line = (json.dumps(record, ensure_ascii=False) + "\n").encode("utf-8")
+        with self._lock:
+            offset = None
+            if self.path is None:
+                offset = len(self._records)
+                self._records.append(record)
+            else:
+                with open(self.path, "ab") as f:
+                    offset = f.tell()
+                    f.write(line)
+            self._index(signature, problem, offset, owner)
+
+    def lookup(self, problem, threshold=0.5, limit=3, owner=None):
+        # Earlier runs at least threshold similar (estimated Jaccard of shingles), best first:
+        # [{"problem", "score", "same_numbers", "exact", "strategy", "stages", "timestamp"}, ...]
+        # exact means the same words once case, spacing and number words are normalized.
+        signature = self.signature(problem)
+        words = normalize(problem)
+        query_numbers = numbers(words)
+        with self._lock:
+            # Groups sharing the most bands first; past max_candidates the rest are unlikely to score
+            hits = Counter()
+            for bucket, key in zip(self._buckets, self._band_keys(signature)):
+                hits.update(bucket.get(key, ()))
+            exact = self._exact.get((owner, " ".join(words)))
+            if not hits and exact is None:
+                return []
+            groups = [group for group, _ in hits.most_common(self.max_candidates)]
+            scores = (self._signatures[groups] == signature).mean(axis=1).tolist() if groups else []
+            ranked = []
+            for group, score in zip(groups, scores):
+                if score < threshold:
+                    continue
+                members = self._members[group].get(owner)
+                if members is None:
+                    continue
+                # The latest runs with the query's numbers, then the latest run of each other set of numbers
+                ranked += [(score, True, entry) for entry in members.get(query_numbers, [])[-limit:]]
+                ranked += [(score, False, entries[-1]) for nums, entries in
+                           itertools.islice(((n, e) for n, e in reversed(members.items()) if n != query_numbers), limit)]
+            if exact is not None and all(entry != exact for _, _, entry in ranked):
+                ranked.append((1.0, True, exact))
+            # The stored run of this very problem first: a rewording can share every shingle and tie on score
+            ranked = sorted(ranked, key=lambda item: (item[2] == exact, item), reverse=True)[:limit]
+        matches = []
+        query = " ".join(words)
+        for score, same_numbers, entry in ranked:
+            record = self._read(entry)
+            matches.append({"problem": record["problem"], "score": round(score, 3), "same_numbers": same_numbers,
+                            "exact": " ".join(normalize(record["problem"])) == query,
+                            "strategy": record.get("strategy"), "stages": record["stages"], "timestamp": record["timestamp"]})
+        return matches
+
+
+def seed_stages(stages, match):
+    # Solver stages that also see an earlier, similar problem and its final answer as a hint
+    answer = match["stages"][-1][2]
+    return with_note(stages, ("solver",), f' \n\n A similar problem was solved before: {match["problem"]} \n\n Its final answer was: {answer} \n\n '
+                                          f'Check carefully whether the differences between the two problems change the answer. \n\n')
+
+
+similar_runs = SimilarityIndex(os.environ.get("SIMILAR_RUNS_FILE", ".similar_runs.jsonl"))
@@ -0,0 +1,48 @@
+import pytest
+
+from consensus import Consensus, extract_claim
+from pipeline import build_stages, red_team_pipeline
+
+LOCKED = "The gears form a ring of 7, an odd number of meshes, so they lock. Therefore gear 7 cannot rotate."
+AGREES = "I looked for a mistake, but there is none. Therefore the gears lock."
+STAGES = build_stages(red_team_pipeline(2, 2))
+
+
+@pytest.mark.parametrize("text, claim", [
+    (LOCKED, "locked"),
+    ("Since gear 1 turns clockwise, gear 7 turns counterclockwise.", "counterclockwise"),
+    ("It claims the gears lock, but in fact gear 7 rotates clockwise.", "clockwise"),
+    ("Gear 7 turns not clockwise but counterclockwise.", "counterclockwise"),
+    ("Therefore the answer is 42.", "42"),
+])
+def test_takes_the_last_claim(text, claim):
+    assert extract_claim(text) == claim
+
+
+@pytest.mark.parametrize("challenge", [
+    "The solution is wrong: it claims the gears lock, but in fact gear 7 rotates clockwise.",
+    "The conclusion that the gears lock is incorrect.",
+    "Gear 7 doesn't lock.",
+    "The solution assumes the gears lock. In fact they do not lock.",
+    "The gears do not actually seize up, because one of them can slip.",
+])
+def test_disagreeing_challenges_make_no_claim_for_the_answer(challenge):
+    assert extract_claim(challenge) != "locked"
+
+
+def outputs(challenge):
+    return {"solution_1": LOCKED, "solution_2": LOCKED, "challenge_1": AGREES, "challenge_2": challenge}
+
+
+def test_agreeing_challenges_reach_consensus():
+    assert Consensus().decide(STAGES, outputs(AGREES))["claim"] == "locked"
+
+
+@pytest.mark.parametrize("challenge", [
+    "The solution is wrong: it claims the gears lock, but in fact gear 7 rotates clockwise.",
+    "The solution restates that the gears lock. That is mistaken; gear 7 turns counterclockwise.",
+    "The solvers missed that the gears do not lock.",
+    "The answer may be incorrect.",
+])
+def test_disagreeing_challenge_blocks_consensus(challenge):
+    assert Consensus().decide(STAGES, outputs(challenge)) is None
@@ -0,0 +1,39 @@
+import pytest
+
+from gears import solve_gears
+
+RING = ("7 axles are equally spaced around a circle. A gear is placed on each axle such that each gear is engaged with "
+        "the gear to its left and the gear to its right. The gears are numbered 1 to 7 around the circle. ")
+QUESTION = "If gear 3 were rotated clockwise, in which direction would gear 7 rotate?"
+
+
+@pytest.mark.parametrize("question, answer", [
+    (QUESTION, "locked"),
+    ("If gear 3 were rotated clockwise, which way would gear 7 turn?", "locked"),
+    ("If gear 3 were rotated clockwise, would gear 7 rotate clockwise or counterclockwise?", "locked"),
+])
+def test_reads_direction_questions(question, answer):
+    assert solve_gears(RING + question)["answer"] == answer
+
+
+def test_even_ring_alternates():
+    problem = (RING + QUESTION).replace("7 axles", "6 axles").replace("1 to 7", "1 to 6").replace("gear 7", "gear 6")
+    assert solve_gears(problem)["answer"] == "counterclockwise"
+
+
+@pytest.mark.parametrize("problem", [
+    # Not about direction
+    RING + "If gear 3 were rotated clockwise at 60 rpm, how fast would gear 6 rotate?",
+    RING + "If gear 3 were rotated clockwise, how many gears would turn counterclockwise?",
+    RING + "If gear 3 were rotated clockwise, what speed would gear 7 rotate at?",
+    RING + "If gear 3 were rotated clockwise, would gear 7 rotate?",
+    # The layout isn't the plain ring any more
+    RING + "Gear 2 is removed. " + QUESTION,
+    RING + "Gear 5 is missing two teeth. " + QUESTION,
+    RING + "Gear 4 is broken. " + QUESTION,
+    RING + "The belt between the gears can slip. " + QUESTION,
+    # Not a gear problem at all
+    "What is the capital of France?",
+])
+def test_rejects_problems_it_cannot_read(problem):
+    assert solve_gears(problem) is None